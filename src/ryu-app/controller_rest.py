@@ -7,7 +7,7 @@ from ryu.base import app_manager
 
 # WSGI / REST API
 import json
-from ryu.app.wsgi import WSGIApplication, ControllerBase, Response, route
+from ryu.app.wsgi import WSGIApplication, ControllerBase, Response, route, websocket
 from ryu.lib import dpid as dpid_lib
 
 # Base Application:
@@ -23,6 +23,11 @@ from delay_monitor import DelayMonitor
 from flow_statistic import FlowStatistic
 from port_statistic import PortStatistic
 from topology_data import TopologyData
+from stats_collector import StatsCollector
+from loss_prober import LossProber
+from snapshot import snapshots
+from response_cache import ResponseCache, etag_matches, accepts_gzip
+from metric_stream import MetricStream
 
 # logging
 
@@ -31,9 +36,11 @@ class NetworkStat(app_manager.RyuApp):
     _CONTEXTS = {
             'wsgi': WSGIApplication,
             'topology_data': TopologyData,
+            'stats_collector': StatsCollector,
             'port_statistic': PortStatistic,
             'flow_statistic': FlowStatistic,
             'delay_monitor': DelayMonitor,
+            'loss_prober': LossProber,
         }
 
     def __init__(self, *_args, **_kwargs):
@@ -46,9 +53,16 @@ class NetworkStat(app_manager.RyuApp):
 
         # External Apps - Load order: alway start the TopologyData first since the other apps depend on it:
         self.topology_data: TopologyData = _kwargs['topology_data']
+        self.stats_collector: StatsCollector = _kwargs['stats_collector']
         self.port_statistic: PortStatistic = _kwargs['port_statistic']
         self.flow_statistic: FlowStatistic = _kwargs['flow_statistic']
         self.delay_monitor: DelayMonitor = _kwargs['delay_monitor']
+        self.loss_prober: LossProber = _kwargs['loss_prober']
+
+        # Encoded bodies of the snapshot endpoints
+        self.response_cache = ResponseCache()
+        # Deltas of the snapshots pushed to the /stream clients
+        self.metric_stream = MetricStream(snapshots)
     
 class NetworkStatRest(ControllerBase):
 
@@ -56,6 +70,36 @@ class NetworkStatRest(ControllerBase):
         super(NetworkStatRest, self).__init__(req, link, data, **config)
         self.app: NetworkStat = data[REST_APP]
 
+    def _snapshot_response(self, req, name, snapshot=None, endpoint=None, encode=None):
+        """
+        Response with the latest published snapshot of name, its version and
+        publish time in the X-Snapshot-Version and X-Snapshot-Timestamp headers.
+        The body is encoded once per snapshot version and endpoint (encode(data),
+        json by default), gzip compressed if the client accepts it, and
+        answered with 304 when the client already has it (If-None-Match).
+        """
+        if snapshot is None:
+            snapshot = snapshots.get(name)
+        if snapshot is None:
+            body = json.dumps({'error': 'no %s snapshot published yet' % name})
+            return Response(content_type='application/json', body=body, status=503)
+        cached = self.app.response_cache.get(endpoint or name, snapshot, encode)
+
+        gzipped = accepts_gzip(req.headers.get('Accept-Encoding'))
+        etag = cached.gzip_etag if gzipped else cached.etag
+        if etag_matches(req.headers.get('If-None-Match'), etag):
+            response = Response(status=304)
+        elif gzipped:
+            response = Response(content_type='application/json', body=cached.gzip_body(), status=200)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(content_type='application/json', body=cached.body, status=200)
+        response.headers['ETag'] = etag
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['X-Snapshot-Version'] = str(snapshot.version)
+        response.headers['X-Snapshot-Timestamp'] = '%.6f' % snapshot.timestamp
+        return response
+
     @route(REST_APP, '/', methods=['GET'])
     def hello(self, req, **_kwargs):
         body = json.dumps([{'hello': 'world'}])
@@ -81,32 +125,22 @@ class NetworkStatRest(ControllerBase):
     # network info
     @route(REST_APP, '/topology_data', methods=['GET'])
     def topology_data(self, req, **_kwargs):
-        hosts, switches, links = self.app.topology_data.get_topology_data()
-        topo = {
-            'host': hosts,
-            'switch': switches,
-            'link': links
-        }
-        body = json.dumps(topo)
-        return Response(content_type='application/json', body=body, status=200)
+        return self._snapshot_response(req, 'topology_data', self.app.topology_data.topology_data_snapshot())
 
     @route(REST_APP, '/hosts', methods=['GET'])
     def get_hosts(self, req):
-        hosts = self.app.topology_data.get_host()
-        body = json.dumps({'hosts': hosts})
-        return Response(content_type='application/json', body=body, status=200)
+        return self._snapshot_response(req, 'topology_data', self.app.topology_data.topology_data_snapshot(),
+                                       endpoint='hosts', encode=lambda topo: json.dumps({'hosts': topo['host']}))
         
     @route(REST_APP, '/links', methods=['GET'])
     def get_links(self, req):
-        links = self.app.topology_data.get_link()
-        body = json.dumps({'link': links})
-        return Response(content_type='application/json', body=body, status=200)
+        return self._snapshot_response(req, 'topology_data', self.app.topology_data.topology_data_snapshot(),
+                                       endpoint='links', encode=lambda topo: json.dumps({'link': topo['link']}))
 
     @route(REST_APP, '/switches', methods=['GET'])
     def get_switches(self, req):
-        switches = self.app.topology_data.get_switch()
-        body = json.dumps({'switch': switches})
-        return Response(content_type='application/json', body=body, status=200)
+        return self._snapshot_response(req, 'topology_data', self.app.topology_data.topology_data_snapshot(),
+                                       endpoint='switches', encode=lambda topo: json.dumps({'switch': topo['switch']}))
 
     @route(REST_APP, '/link_to_port', methods=['GET'])
     def get_link_to_port(self, req):
@@ -114,34 +148,51 @@ class NetworkStatRest(ControllerBase):
         Get link_to_port data with json format:
         {src_dpid: {dst_dpid: [src_port, dst_port]}, ...}
         '''
-        data = self.app.topology_data.link_to_port
-        reformated_result = {}
-        for key in data.keys():
-            if key[0] not in reformated_result.keys():
-                reformated_result[key[0]] = {key[1]: list(data[key])}
-            reformated_result[key[0]][key[1]] = list(data[key])
-        body = json.dumps(reformated_result)
+        return self._snapshot_response(req, 'link_to_port')
+
+    @route(REST_APP, '/topology_coalesce', methods=['GET'])
+    def get_topology_coalesce(self, req, **kwargs):
+        """
+        Get topology event coalescing stats: events folded per flush, flush latency
+        """
+        body = json.dumps(self.app.topology_data.get_coalesce_stats())
         return Response(content_type='application/json', body=body, status=200)
 
     # network monitor
     @route(REST_APP, '/port_stat', methods=['GET'])
     def get_port_stat(self, req, **kwargs):
-        body = json.dumps(self.app.port_statistic.get_port_stats())
-        return Response(content_type='application/json', body=body)
+        return self._snapshot_response(req, 'port_stat')
     
     @route(REST_APP, '/delta_port_stat', methods=['GET'])
     def get_delta_port_stat(self, req, **kwargs):
-        body = json.dumps(self.app.port_statistic.get_delta_port_stats())
-        return Response(content_type='application/json', body=body)
+        return self._snapshot_response(req, 'delta_port_stat')
 
     @route(REST_APP, '/flow_stat', methods=['GET'])
     def get_flow_stat(self, req, **kwargs):
-        body = json.dumps(self.app.flow_statistic.get_flow_stats())
-        return Response(content_type='application/json', body=body)
+        return self._snapshot_response(req, 'flow_stat')
+
+    @route(REST_APP, '/flow_speed', methods=['GET'])
+    def get_flow_speed(self, req, **kwargs):
+        return self._snapshot_response(req, 'flow_speed')
+
+    @route(REST_APP, '/flow_entry_stat', methods=['GET'])
+    def get_flow_entry_stat(self, req, **kwargs):
+        """
+        Get flow entries received in flow stats replies against entries used, per datapath
+        """
+        return self._snapshot_response(req, 'flow_entry_stat')
 
     @route(REST_APP, '/delta_flow_stat', methods=['GET'])
     def get_delta_flow_stat(self, req, **kwargs):
-        body = json.dumps(self.app.flow_statistic.get_delta_flow_stats())
+        return self._snapshot_response(req, 'delta_flow_stat')
+
+    @route(REST_APP, '/poll_rate', methods=['GET'])
+    def get_poll_rate(self, req, **kwargs):
+        """
+        Get effective polls per second, poll interval, activity and request stats
+        of every stat type and datapath
+        """
+        body = json.dumps(self.app.stats_collector.get_poll_stats())
         return Response(content_type='application/json', body=body)
 
     # @route(REST_APP, '/port_desc', methods=['GET'])
@@ -149,6 +200,39 @@ class NetworkStatRest(ControllerBase):
     #     body = self.app.port_statistic.port_desc.to_json(orient='records')
     #     return Response(content_type='application/json', body=body, status=200)
     
+    @route(REST_APP, '/probe_stat', methods=['GET'])
+    def get_probe_stat(self, req, **kwargs):
+        """
+        Get loss and one-way delay (ms) of the latest probe train of every link in probe mode
+        """
+        return self._snapshot_response(req, 'probe_stat')
+
+    @route(REST_APP, '/delay_stat', methods=['GET'])
+    def get_delay_stat(self, req, **kwargs):
+        """
+        Get delay statistics (ms) of every link over its recent samples:
+        ewma, min, p50, p95, p99 and jitter
+        """
+        return self._snapshot_response(req, 'delay_stat')
+
+    @websocket(REST_APP, '/stream')
+    def stream(self, ws):
+        """
+        Websocket pushing, every cycle, the links, ports and flows whose metrics changed:
+        {'resource', 'version', 'timestamp', 'changed': [item,...], 'removed': [key,...]}
+        Filters: ?resource=link_quality,port_stat&dpid=1,2&metric=delay,packet_loss,
+        or a json object with the same keys sent on the socket.
+        """
+        self.app.metric_stream.serve(ws)
+
+    @route(REST_APP, '/stream_stat', methods=['GET'])
+    def get_stream_stat(self, req, **kwargs):
+        """
+        Get stream clients, clients dropped as too slow, queued and sent messages per client
+        """
+        body = json.dumps(self.app.metric_stream.get_stream_stats())
+        return Response(content_type='application/json', body=body)
+
     @route(REST_APP, '/link_quality', methods=['GET'])
     def get_link_quality(self, req, **kwargs):
         """_summary_
@@ -156,9 +240,7 @@ class NetworkStatRest(ControllerBase):
         Returns:
             _type_: json string response
         """
-        link_quality = self.app.topology_data.get_link_quality()
-        body = json.dumps(link_quality)
-        return Response(content_type='application/json', body=body, status=200)
+        return self._snapshot_response(req, 'link_quality')
     
     @route(REST_APP, '/topology_graph', methods=['GET'])
     def get_topology_graph(self, req, **kwargs):
@@ -167,8 +249,6 @@ class NetworkStatRest(ControllerBase):
         Returns:
             _type_: json string response
         """
-        graph = self.app.topology_data.get_topology_graph()
-        body = json.dumps(graph)
-        return Response(content_type='application/json', body=body, status=200)
+        return self._snapshot_response(req, 'topology_graph', self.app.topology_data.topology_graph_snapshot())
 
 # ryu-manager --observe-link --ofp-tcp-listen-port=6633 --wsapi-port=8080 controller_rest.py
\ No newline at end of file
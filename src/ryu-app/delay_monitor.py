@@ -23,11 +23,17 @@ from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 
 from ryu.lib import hub
-from ryu.topology.switches import Switches, LLDPPacket
+from ryu.topology.switches import Switches, EventLLDPPacketIn
 import networkx as nx
+import numpy as np
+import struct
 import time
-from setting import DELAY_MONITOR, TOPOLOGY_DATA, DELAY_DETECTING_INTERVAL
+from collections import deque
+from setting import DELAY_MONITOR, TOPOLOGY_DATA, DELAY_DETECTING_INTERVAL, ECHO_RTT_WINDOW, STATS_COLLECTOR
 from topology_data import TopologyData
+from stats_collector import StatsCollector, ECHO
+from delay_stats import DelayStats
+from snapshot import snapshots
 
 class DelayMonitor(app_manager.RyuApp):
     """
@@ -36,58 +42,75 @@ class DelayMonitor(app_manager.RyuApp):
 
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
+    DELAY_STATS_KEYS = ('ewma', 'min', 'p50', 'p95', 'p99', 'jitter')
+
     def __init__(self, *args, **kwargs):
         super(DelayMonitor, self).__init__(*args, **kwargs)
         self.name = DELAY_MONITOR
-        self.sending_echo_request_interval = 0.05
         
         # Get the active object of swicthes and awareness module.
         # So that this module can use their data.
         self.sw_module: Switches = lookup_service_brick('switches')
         self.topology_data: TopologyData = lookup_service_brick('topology_data')
+        self.collector: StatsCollector = None
+
+        self.echo_latency = {}  # {dpid: mean echo rtt over the window} (s)
+        self.echo_rtt = {}      # {dpid: deque([rtt,...], maxlen=ECHO_RTT_WINDOW)}
+        self.delay_stats = DelayStats() # delay statistics by link metric row
+        self.link_index = None  # (link list it is built for, switches, reverse rows, src index, dst index), see _link_index
 
-        self.echo_latency = {}
         self.measure_thread = hub.spawn(self._detector)
+
+    def start(self):
+        """
+            Echo requests are sent by the stats collector, spread over
+            DELAY_DETECTING_INTERVAL: subscribe once every app is up.
+            Unanswered ones are counted as timeouts in its request stats.
+        """
+        self.collector = lookup_service_brick(STATS_COLLECTOR)
+        self.collector.subscribe(ECHO, self._echo_reply_handler, DELAY_DETECTING_INTERVAL)
+        self._publish_snapshot()
+        return super(DelayMonitor, self).start()
         
     def _detector(self):
         """
             Delay detecting functon.
-            Send echo request and calculate link delay periodically
+            Calculate link delay periodically
         """
         while True:
-            self._send_echo_request()
             self.create_link_delay()
+            self._publish_snapshot()
             # self.show_delay_statis()
             hub.sleep(DELAY_DETECTING_INTERVAL)
 
-    def _send_echo_request(self):
+    def _publish_snapshot(self):
         """
-            Seng echo request msg to datapath.
+            Publish the delay stats of this cycle.
         """
-        try:
-            for datapath in self.topology_data.datapaths.values():
-                parser = datapath.ofproto_parser
-                
-                # by second unit
-                data_time = "%.12f" % time.time()
-                byte_arr = bytearray(data_time.encode())
-
-                echo_req = parser.OFPEchoRequest(datapath,
-                                                 data=byte_arr)
-                datapath.send_msg(echo_req)
-
-                # Important! Don't send echo request together, Because it will
-                # generate a lot of echo reply almost in the same time.
-                # which will generate a lot of delay of waiting in queue
-                # when processing echo reply in echo_reply_handler.
-                hub.sleep(self.sending_echo_request_interval)
-        except self.topology_data is None:
-            self.topology_data = lookup_service_brick(TOPOLOGY_DATA)
+        if self.topology_data is None:
             return
-        
-    def _get_delay(self, src, dst):
+        snapshots.publish('delay_stat', self.get_delay_stats())
+
+    def _link_index(self, rows, links):
+        """
+            Index arrays of links, rebuilt when the link list changes:
+            row of the reverse link (-1 if unknown), position of the src
+            and dst switch in the switch list.
+        """
+        if self.link_index is None or self.link_index[0] is not links:
+            self.delay_stats.follow(rows, links)
+            link_metrics = self.topology_data.link_metrics
+            dpids = sorted(set(dpid for link in links for dpid in link))
+            position = {dpid: i for i, dpid in enumerate(dpids)}
+            reverse_rows = link_metrics.lookup([(dst, src) for src, dst in links])
+            src_index = np.fromiter((position[src] for src, _ in links), dtype=np.int64, count=len(links))
+            dst_index = np.fromiter((position[dst] for _, dst in links), dtype=np.int64, count=len(links))
+            self.link_index = (links, dpids, reverse_rows, src_index, dst_index)
+        return self.link_index[1:]
+
+    def _get_delay(self, rows, links):
         """
-            Get link delay.
+            Get the delay of every link at once (s), nan when unknown.
                         Controller
                         |        |
         src echo latency|        |dst echo latency
@@ -97,21 +120,22 @@ class DelayMonitor(app_manager.RyuApp):
                     fwd_delay--->
                         <----reply_delay
             delay = (forward delay + reply delay - src datapath's echo latency
+                     - dst datapath's echo latency) / 2
         """
-        try:
-            fwd_delay = self.topology_data.graph[src][dst]['lldpdelay']
-            re_delay = self.topology_data.graph[dst][src]['lldpdelay']
-            src_latency = self.echo_latency[src]
-            dst_latency = self.echo_latency[dst]
-            
-            delay = (fwd_delay + re_delay - src_latency - dst_latency)/2
-            return max(delay, 0)
-        except:
-            return float('inf')
+        dpids, reverse_rows, src_index, dst_index = self._link_index(rows, links)
+        lldpdelay = self.topology_data.link_metrics.column('lldpdelay')
+        fwd_delay = lldpdelay[rows]
+        re_delay = np.where(reverse_rows >= 0, lldpdelay[reverse_rows], np.nan)
+        echo_latency = self.echo_latency
+        latency = np.array([echo_latency.get(dpid, np.nan) for dpid in dpids], dtype=np.float64)
+
+        delay = (fwd_delay + re_delay - latency[src_index] - latency[dst_index]) / 2
+        # nan stays nan
+        return np.maximum(delay, 0)
 
     def _save_lldp_delay(self, src=0, dst=0, lldpdelay=0):
         try:
-            self.topology_data.graph[src][dst]['lldpdelay'] = lldpdelay
+            self.topology_data.link_metrics.set_link('lldpdelay', (src, dst), lldpdelay)
         except:
             if self.topology_data is None:
                 self.topology_data = lookup_service_brick(TOPOLOGY_DATA)
@@ -119,57 +143,91 @@ class DelayMonitor(app_manager.RyuApp):
 
     def create_link_delay(self):
         """
-            Create link delay data, and save it into graph object.
+            Create link delay data, and save it into the link metrics.
         """
         try:
-            for src in self.topology_data.graph:
-                for dst in self.topology_data.graph[src]:
-                    if src == dst:
-                        self.topology_data.graph[src][dst]['delay'] = 0
-                        continue
-                    delay = self._get_delay(src, dst)
-                    # avoid json error by give it none
-                    if delay == float('inf'):
-                        delay = None
-                    # convert from s to ms unit
-                    self.topology_data.graph[src][dst]['delay'] = delay * 1000
+            link_metrics = self.topology_data.link_metrics
+            rows, links = link_metrics.live()
+            # convert from s to ms unit
+            delay = self._get_delay(rows, links) * 1000
+            link_metrics.set('delay', rows, delay)
+            self._save_delay_stats(rows, delay)
         except:
             if self.topology_data is None:
                 self.topology_data: TopologyData = lookup_service_brick(TOPOLOGY_DATA)
             return
 
-    @set_ev_cls(ofp_event.EventOFPEchoReply, MAIN_DISPATCHER)
+    def _save_delay_stats(self, rows, delay):
+        """
+            Add the delay sample (ms) of every link to its window, and save the
+            statistics as the delay_ewma, delay_min, delay_p50, delay_p95,
+            delay_p99 and delay_jitter link metrics.
+        """
+        known = ~np.isnan(delay)
+        self.delay_stats.add(rows[known], delay[known])
+        summary = self.delay_stats.summary(rows)
+        link_metrics = self.topology_data.link_metrics
+        for key in self.DELAY_STATS_KEYS:
+            link_metrics.set('delay_' + key, rows, summary[key])
+
     def _echo_reply_handler(self, ev):
         """
             Handle the echo reply msg, and get the latency of link.
         """
-        now_timestamp = time.time()
-        try:
-            latency = now_timestamp - eval(ev.msg.data)
-            self.echo_latency[ev.msg.datapath.id] = latency
-        except:
+        now = time.monotonic_ns()
+        data = ev.msg.data
+        if data is None or len(data) != StatsCollector.ECHO_PAYLOAD_SIZE:
+            # not one of ours
             return
+        send_time, seq = struct.unpack(StatsCollector.ECHO_PAYLOAD_STR, data)
+
+        dpid = ev.msg.datapath.id
+        rtt = (now - send_time) / 10 ** 9
+        window = self.echo_rtt.get(dpid)
+        if window is None:
+            window = self.echo_rtt[dpid] = deque(maxlen=ECHO_RTT_WINDOW)
+        window.append(rtt)
+        self.echo_latency[dpid] = sum(window) / len(window)
     
-    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
-    def _packet_in_handler(self, ev):
+    @set_ev_cls(EventLLDPPacketIn)
+    def _lldp_packet_in_handler(self, ev):
         """
-            Parsing LLDP packet and get the delay of link.
+            Get the delay of link from the LLDP packet-in parsed by Switches.
         """
-        msg = ev.msg
-        try:
-            src_dpid, src_port_no = LLDPPacket.lldp_parse(msg.data)
-            dpid = msg.datapath.id
-            if self.sw_module is None:
-                self.sw_module = lookup_service_brick('switches')
-
-            for port in self.sw_module.ports.keys():
-                if src_dpid == port.dpid and src_port_no == port.port_no:
-                    delay = self.sw_module.ports[port].delay
-                    self._save_lldp_delay(src=src_dpid, dst=dpid,
-                                          lldpdelay=delay)
-        except LLDPPacket.LLDPUnknownFormat as e:
+        if ev.send_timestamp is not None:
+            # lldp-probe mode: the packet carries its own send time
+            self._save_lldp_delay(src=ev.src_dpid, dst=ev.dst_dpid,
+                                  lldpdelay=ev.recv_timestamp - ev.send_timestamp)
             return
 
+        if self.sw_module is None:
+            self.sw_module = lookup_service_brick('switches')
+
+        port_data = self.sw_module.ports.get_port_data_by_no(ev.src_dpid,
+                                                              ev.src_port_no)
+        if port_data is not None:
+            self._save_lldp_delay(src=ev.src_dpid, dst=ev.dst_dpid,
+                                  lldpdelay=port_data.delay)
+
+    """
+        Accessor:
+        return info as dict
+    """
+    def get_delay_stats(self):
+        delay_stats = self.delay_stats
+        rows, links = self.topology_data.link_metrics.live()
+        # links with samples, as of the last delay update
+        followed = [(row, link) for row, link in zip(rows.tolist(), links)
+                    if row < len(delay_stats.row_links) and delay_stats.row_links[row] == link
+                    and delay_stats.count[row] > 0]
+        summary = delay_stats.summary(np.array([row for row, _ in followed], dtype=np.int64))
+        summary = {key: values.tolist() for key, values in summary.items()}
+        stats = []
+        for i, (_, (src_dpid, dst_dpid)) in enumerate(followed):
+            stats.append(dict({key: values[i] for key, values in summary.items()},
+                              src_dpid=src_dpid, dst_dpid=dst_dpid))
+        return stats
+
     # def show_delay_statis(self):
     #     if False and self.topology_data is not None:
     #         self.logger.info("\nsrc   dst      delay")
@@ -0,0 +1,183 @@
+# Streaming delay statistics of the links
+import numpy as np
+
+from setting import DELAY_STATS_WINDOW, DELAY_EWMA_ALPHA
+
+
+class DelayStats(object):
+    """
+        Delay statistics of every link over its last samples, in arrays
+        indexed by the link metric rows, O(1) per sample: EWMA, min,
+        p50/p95/p99 and RFC 3550 interarrival jitter.
+
+        The quantiles are P-square estimates (Jain & Chlamtac, 1985): five
+        markers per quantile, no samples kept. Two sets of sketches are
+        restarted every window samples, half a window apart, and the older
+        one is reported, so an estimate always covers between window/2 and
+        window recent samples. Its lowest marker is the min over them.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window=DELAY_STATS_WINDOW, alpha=DELAY_EWMA_ALPHA, rows=64):
+        self.window = window
+        self.alpha = alpha
+
+        # Sketch columns: quantiles of the first set, then of the second one
+        p = np.tile(self.QUANTILES, 2)
+        self.p = p
+        self.offset = np.repeat((0, window // 2), len(self.QUANTILES))  # sample index a set starts at
+        self.n0 = np.tile(np.arange(5, dtype=np.float64), (len(p), 1))
+        self.np0 = np.stack((np.zeros_like(p), 2 * p, 4 * p, 2 + 2 * p, np.full_like(p, 4)), axis=1)
+        self.dn = np.stack((np.zeros_like(p), p / 2, p, (1 + p) / 2, np.ones_like(p)), axis=1)
+
+        self.row_links = [None] * rows          # [row]: link the statistics are of
+        self._alloc(rows)
+
+    def _alloc(self, rows):
+        sketches = len(self.p)
+        self.count = np.zeros(rows, dtype=np.int64)         # samples seen
+        self.ewma = np.full(rows, np.nan)
+        self.last = np.full(rows, np.nan)
+        self.jitter = np.full(rows, np.nan)
+        self.q = np.full((rows, sketches, 5), np.inf)       # marker heights
+        self.n = np.tile(self.n0, (rows, 1, 1))             # marker positions
+        self.npos = np.tile(self.np0, (rows, 1, 1))         # desired marker positions
+        self.sketch_count = np.full((rows, sketches), -1, dtype=np.int64)  # samples of the sketch, -1 not started
+
+    def _grow(self, rows):
+        """
+            Grow to at least rows rows, keeping the stored statistics.
+        """
+        old = len(self.count)
+        if rows <= old:
+            return
+        stores = (self.count, self.ewma, self.last, self.jitter, self.q, self.n, self.npos, self.sketch_count)
+        self._alloc(max(rows, 2 * old))
+        for name, store in zip(('count', 'ewma', 'last', 'jitter', 'q', 'n', 'npos', 'sketch_count'), stores):
+            getattr(self, name)[:old] = store
+        self.row_links.extend([None] * (len(self.count) - old))
+
+    def follow(self, rows, links):
+        """
+            Rows now holding another link start over.
+        """
+        if len(rows):
+            self._grow(int(rows.max()) + 1)
+        changed = [row for row, link in zip(rows.tolist(), links) if self.row_links[row] != link]
+        for row, link in zip(rows.tolist(), links):
+            self.row_links[row] = link
+        self.reset(np.array(changed, dtype=np.int64))
+
+    def reset(self, rows):
+        self.count[rows] = 0
+        self.ewma[rows] = np.nan
+        self.last[rows] = np.nan
+        self.jitter[rows] = np.nan
+        self.q[rows] = np.inf
+        self.n[rows] = self.n0
+        self.npos[rows] = self.np0
+        self.sketch_count[rows] = -1
+
+    def add(self, rows, delay):
+        """
+            Add one delay sample per row: rows unique, delay aligned with them.
+        """
+        if not len(rows):
+            return
+        i = self.count[rows]
+        self.count[rows] = i + 1
+
+        last = self.last[rows]
+        first = np.isnan(last)
+        ewma = self.ewma[rows]
+        self.ewma[rows] = np.where(first, delay, ewma + self.alpha * (delay - ewma))
+        jitter = self.jitter[rows]
+        self.jitter[rows] = np.where(first, 0, jitter + (np.abs(delay - last) - jitter) / 16)
+        self.last[rows] = delay
+
+        # (re)start the sketch sets due
+        index = i[:, None] - self.offset
+        restart = (index >= 0) & (index % self.window == 0)
+        if restart.any():
+            r, k = np.nonzero(restart)
+            self.q[rows[r], k] = np.inf
+            self.n[rows[r], k] = self.n0[k]
+            self.npos[rows[r], k] = self.np0[k]
+            self.sketch_count[rows[r], k] = 0
+
+        count = self.sketch_count[rows]
+        # first five samples: kept sorted in the markers
+        r, k = np.nonzero((count >= 0) & (count < 5))
+        if len(r):
+            self.q[rows[r], k, count[r, k]] = delay[r]
+            self.q[rows[r], k] = np.sort(self.q[rows[r], k], axis=-1)
+        r, k = np.nonzero(count >= 5)
+        if len(r):
+            self._update(rows[r], k, delay[r])
+        self.sketch_count[rows] = np.where(count >= 0, count + 1, count)
+
+    def _update(self, rows, k, x):
+        """
+            P-square step of the sketches (rows, k) with samples x.
+        """
+        q = self.q[rows, k]
+        n = self.n[rows, k]
+        npos = self.npos[rows, k] + self.dn[k]
+
+        np.minimum(q[:, 0], x, out=q[:, 0])
+        np.maximum(q[:, 4], x, out=q[:, 4])
+        # cell of x: q[cell] <= x < q[cell + 1]
+        cell = (x[:, None] >= q[:, 1:4]).sum(axis=1)
+        n += np.arange(5) > cell[:, None]
+
+        # move the middle markers toward their desired positions
+        for i in (1, 2, 3):
+            d = npos[:, i] - n[:, i]
+            move = ((d >= 1) & (n[:, i + 1] - n[:, i] > 1)) | ((d <= -1) & (n[:, i - 1] - n[:, i] < -1))
+            if not move.any():
+                continue
+            m = np.nonzero(move)[0]
+            d = np.sign(d[m])
+            qa, qi, qb = q[m, i - 1], q[m, i], q[m, i + 1]
+            na, ni, nb = n[m, i - 1], n[m, i], n[m, i + 1]
+            qp = qi + d / (nb - na) * ((ni - na + d) * (qb - qi) / (nb - ni) +
+                                       (nb - ni - d) * (qi - qa) / (ni - na))
+            # parabolic step overshoots: linear one
+            qd = np.where(d > 0, qb, qa)
+            nd = np.where(d > 0, nb, na)
+            linear = qi + d * (qd - qi) / (nd - ni)
+            q[m, i] = np.where((qa < qp) & (qp < qb), qp, linear)
+            n[m, i] += d
+
+        self.q[rows, k] = q
+        self.n[rows, k] = n
+        self.npos[rows, k] = npos
+
+    def summary(self, rows):
+        """
+            {'ewma', 'min', 'p50', 'p95', 'p99', 'jitter', 'samples'} arrays aligned
+            with rows, nan for rows without sample.
+        """
+        quantiles = len(self.QUANTILES)
+        size = len(rows)
+        count = self.sketch_count[rows].reshape(size, 2, quantiles)[:, :, 0]
+        older = np.argmax(count, axis=1)
+        select = np.arange(size)
+        q = self.q[rows].reshape(size, 2, quantiles, 5)[select, older]
+        count = count[select, older]
+        # fewer than five samples: nearest rank of the sorted ones
+        rank = np.rint(np.asarray(self.QUANTILES) * (count[:, None] - 1)).astype(np.int64)
+        position = np.where(count[:, None] >= 5, 2, np.clip(rank, 0, 4))
+        values = np.take_along_axis(q, position[:, :, None], axis=2)[:, :, 0]
+        values[count <= 0] = np.nan
+        minimum = np.where(count > 0, q[:, 0, 0], np.nan)
+        return {
+            'ewma': self.ewma[rows],
+            'min': minimum,
+            'p50': values[:, 0],
+            'p95': values[:, 1],
+            'p99': values[:, 2],
+            'jitter': self.jitter[rows],
+            'samples': np.minimum(self.count[rows], self.window),
+        }
@@ -1,19 +1,25 @@
 # Base
-from ast import operator
 from ryu.base import app_manager
 from ryu.base.app_manager import lookup_service_brick
 from ryu.ofproto import ofproto_v1_3
 
 
 from ryu.controller import ofp_event
-from ryu.controller.handler import set_ev_cls, MAIN_DISPATCHER
+from ryu.controller.handler import set_ev_cls, MAIN_DISPATCHER, DEAD_DISPATCHER
 
 from ryu.lib import hub
-from setting import FLOW_STATISTIC, STATS_REQUEST_INTERVAL, TOPOLOGY_DATA, PROBE_PACKETLOSS_INTERVAL
+from setting import FLOW_STATISTIC, STATS_REQUEST_INTERVAL, TOPOLOGY_DATA, PROBE_PACKETLOSS_INTERVAL, FLOW_STATS_MAX_ENTRIES, \
+    STATS_COLLECTOR, STATS_MAX_INTERVAL, FLOW_STATS_PRIORITY, LINK_LOSS_MODE, LINK_LOSS_MODES
 
 from topology_data import TopologyData
+from stat_history import StatHistory, counter_delta
+from stats_collector import StatsCollector, FLOW_STATS, AGGREGATE
+from snapshot import snapshots
 
-import operator
+import time
+import numpy as np
+
+FLOW_STAT_COLUMNS = ('packet_count', 'byte_count', 'duration_sec', 'duration_nsec')
 
 class FlowStatistic(app_manager.RyuApp):
 
@@ -25,80 +31,136 @@ class FlowStatistic(app_manager.RyuApp):
         self.name = FLOW_STATISTIC
 
         self.topology_data: TopologyData = lookup_service_brick(TOPOLOGY_DATA)
+        self.collector: StatsCollector = None
         
-        self.monitor = hub.spawn(self._monitor_thread)
         self.pkl = hub.spawn(self._packet_loss_monitor_thread)
         
-        self.flow_stats = {} # {dpid: {(in_port, eth_dst, out_port): [(packet_count, byte_count, duration_sec, duration_nsec),... ]},... }
-        self.delta_flow_stats = {} # {dpid: {(in_port, eth_dst, out_port): [(delta_packet, speed),... ]},...  }
+        self.flow_stats = {} # {dpid: StatHistory {(in_port, out_port, eth_src, eth_dst): ring of (packet_count, byte_count, duration_sec, duration_nsec)},... }
+        self.delta_flow_stats = {} # {dpid: StatHistory {(in_port, out_port, eth_src, eth_dst): ring of deltas of the flow_stats columns},...  }
+        # Flow keys by link endpoint, to join the two ends of a link in linear time
+        self.flow_out_index = {} # {dpid: {out_port: {(eth_src, eth_dst): {flow key,...}}}} - upstream end
+        self.flow_in_index = {} # {dpid: {in_port: {(eth_src, eth_dst): {flow key,...}}}} - downstream end
+        self.flow_speed = {} # {dpid: {(in_port, out_port, eth_src, eth_dst): (packet/s, byte/s)},... }
+        self.flow_clock = 0 # bumped per reply cycle, stamps flow entries for expiry and LRU eviction
+        self.flow_cycle = {} # {dpid: [xid, stamp, entries, activity]} - multipart reply still arriving
+        self.flow_entries = {} # {dpid: {'received': n, 'used': n}} - flow entries in replies / kept for analysis
+        self.aggregate_stats = {} # {(dpid, target): (time, packet_count, packet/s)} - target: ('out_port' or 'in_port', port_no)
+        self.aggregate_targets = {} # {dpid: {target,...}} - requested from the collector
         self.packet_loss = {}
         self.link_loss = {}
     
-    def _monitor_thread(self):
-        while True:
-            for dp in self.topology_data.datapaths.values():
-                self._request_stats(dp)
-            hub.sleep(STATS_REQUEST_INTERVAL)
+    def start(self):
+        """
+            Flow stats are polled by the stats collector: subscribe once every app is up.
+        """
+        self.collector = lookup_service_brick(STATS_COLLECTOR)
+        self.collector.subscribe(FLOW_STATS, self._flow_stats_reply_handler, STATS_MAX_INTERVAL)
+        self.collector.subscribe(AGGREGATE, self._aggregate_stats_reply_handler, PROBE_PACKETLOSS_INTERVAL)
+        self._publish_snapshot()
+        return super(FlowStatistic, self).start()
     
     def _packet_loss_monitor_thread(self):
         while True:
             hub.sleep(PROBE_PACKETLOSS_INTERVAL)
             self._get_link_loss()
-    
-    def _request_stats(self, datapath):
-        self.logger.debug('send stats request: %016x', datapath.id)
-        parser = datapath.ofproto_parser
-
-        req = parser.OFPFlowStatsRequest(datapath)
-        datapath.send_msg(req)
-    
-    def _save_stats(self, _dict, key, value, history_length=2):
-        if key not in _dict:
-            _dict[key] = []
-        _dict[key].append(value)
-
-        if len(_dict[key]) > history_length:
-            _dict[key].pop(0)
-
-    def _cal_delta_stat(self, now, pre, period):
-        if period: return (now - pre) / (period)
-        else: return
+            self._publish_snapshot()
 
-    def _get_time(self, sec, nsec):
-        return sec + nsec / (10 ** 9)
-
-    def _get_period(self, n_sec, n_nsec, p_sec, p_nsec):
-        return self._get_time(n_sec, n_nsec) - self._get_time(p_sec, p_nsec)
+    def _publish_snapshot(self):
+        """
+            Publish the flow stats of this cycle.
+        """
+        snapshots.publish('flow_stat', self.get_flow_stats())
+        snapshots.publish('delta_flow_stat', self.get_delta_flow_stats())
+        snapshots.publish('flow_speed', self.get_flow_speed())
+        snapshots.publish('flow_entry_stat', {dpid: dict(entries) for dpid, entries in self.flow_entries.items()})
     
     # calculate packet loss on link by flow stat:
     def _get_link_loss(self):
         try:
-            for src in self.topology_data.graph:
-                for dst in self.topology_data.graph[src]:
-                    if src == dst:
-                        self.topology_data.graph[src][dst]['packet_loss'] = 0
+            targets = {} # {dpid: {target,...}} - aggregate stats the links need
+            link_metrics = self.topology_data.link_metrics
+            rows, links = link_metrics.live()
+            packet_loss = np.full(len(links), np.nan) # nan (null) while unknown
+            flow_mode = np.zeros(len(links), dtype=bool) # links whose loss is computed here
+            for i, (src, dst) in enumerate(links):
+                mode = LINK_LOSS_MODES.get((src, dst), LINK_LOSS_MODE)
+                if mode in ('port', 'probe'):
+                    # PortStatistic._save_port_loss, LossProber
+                    continue
+                flow_mode[i] = True
+                if mode == 'aggregate':
+                    ports = self.topology_data.get_link_to_port(src, dst)
+                    if ports is None:
                         continue
-                    packet_loss = self._link_loss_match(src, dst)
-                    if packet_loss is not None:
-                        self.topology_data.graph[src][dst]['packet_loss'] = packet_loss   
+                    src_port, dst_port = ports
+                    targets.setdefault(src, set()).add(('out_port', src_port))
+                    targets.setdefault(dst, set()).add(('in_port', dst_port))
+                    loss = self._aggregate_link_loss(src, dst, src_port, dst_port)
+                else:
+                    loss = self._link_loss_match(src, dst)
+                if loss is not None:
+                    packet_loss[i] = loss
+            link_metrics.set('packet_loss', rows[flow_mode], packet_loss[flow_mode])
+            self._set_aggregate_targets(targets)
         except:
             if self.topology_data is None:
                 self.topology_data = lookup_service_brick('topology_data')
             return
+
+    def _set_aggregate_targets(self, targets):
+        for dpid in set(self.aggregate_targets).union(targets):
+            self.collector.set_aggregate_targets(dpid, targets.get(dpid, ()))
+        for dpid, target in list(self.aggregate_stats):
+            if target not in targets.get(dpid, ()):
+                del self.aggregate_stats[(dpid, target)]
+        self.aggregate_targets = targets
+
+    def _aggregate_link_loss(self, src_dpid, dst_dpid, src_port, dst_port):
+        """
+            Loss from the packet rate of the flows sent out of the link by the
+            upstream switch and received from it by the downstream switch.
+        """
+        src = self.aggregate_stats.get((src_dpid, ('out_port', src_port)))
+        dst = self.aggregate_stats.get((dst_dpid, ('in_port', dst_port)))
+        if src is None or dst is None or not src[2] or dst[2] is None:
+            return None
+        # the two ends are polled at different times: clamp the skew
+        return max(1 - dst[2] / src[2], 0)
+
+    def _aggregate_stats_reply_handler(self, ev, target):
+        """
+            Save the packet count and rate of an aggregate stats target.
+        """
+        dpid = ev.msg.datapath.id
+        if target is None or target not in self.aggregate_targets.get(dpid, ()):
+            return
+        now = time.time()
+        packet_count = ev.msg.body.packet_count
+        prev = self.aggregate_stats.get((dpid, target))
+        rate = None
+        if prev is not None and now > prev[0] and packet_count >= prev[1]:
+            rate = (packet_count - prev[1]) / (now - prev[0])
+        self.aggregate_stats[(dpid, target)] = (now, packet_count, rate)
         
     def _link_loss_match(self, src_dpid, dst_dpid):
-        src_port, dst_port = self.topology_data.get_link_to_port(src_dpid, dst_dpid)
-        src_key_list = list(self.delta_flow_stats[src_dpid].keys())
-        dst_key_list = list(self.delta_flow_stats[dst_dpid].keys())
-        flow_pair = self._flow_pair(src_key_list, dst_key_list, src_port, dst_port)
+        if src_dpid in self.flow_cycle or dst_dpid in self.flow_cycle:
+            # half of the deltas are from the cycle in progress
+            return None
+        ports = self.topology_data.get_link_to_port(src_dpid, dst_dpid)
+        if ports is None:
+            return None
+        src_port, dst_port = ports
+        src_flows = self.flow_out_index.get(src_dpid, {}).get(src_port, {})
+        dst_flows = self.flow_in_index.get(dst_dpid, {}).get(dst_port, {})
+        flow_pair = self._flow_pair(src_flows, dst_flows)
         return self._cal_link_loss(self.delta_flow_stats, src_dpid, dst_dpid, flow_pair)
-        
+
     def _cal_link_loss(self, delta_flow_stats, src_dpid, dst_dpid, key_pair):
         packet_loss_list = []
         for key in key_pair:
             src_key, dst_key = key
-            src_pkt = delta_flow_stats[src_dpid][src_key][-1][0]
-            dst_pkt = delta_flow_stats[dst_dpid][dst_key][-1][0]
+            src_pkt = delta_flow_stats[src_dpid].last(src_key)[0]
+            dst_pkt = delta_flow_stats[dst_dpid].last(dst_key)[0]
             
             if src_pkt == 0: continue
             if src_pkt is None or dst_pkt is None: continue
@@ -110,19 +172,43 @@ class FlowStatistic(app_manager.RyuApp):
         if len(packet_loss_list) == 0: return None
         return sum(packet_loss_list) / len(packet_loss_list)
     
-    def _flow_pair(self, src_key, dst_key, src_port_ltp, dst_port_ltp):
+    def _flow_pair(self, src_flows, dst_flows):
+        """
+            Hash join of the flows leaving the link's src port with the flows
+            entering its dst port on (eth_src, eth_dst).
+        """
         flow_match = []
-        for src in src_key:
-            _, src_port, eth_src_src, eth_dst_src = src
-            for dst in dst_key:
-                dst_port, _, eth_src_dst, eth_dst_dst = dst
-                if src_port == src_port_ltp and dst_port == dst_port_ltp and \
-                   eth_src_src == eth_src_dst and eth_dst_src == eth_dst_dst:
-                    flow_match.append((src, dst))
+        if len(dst_flows) < len(src_flows):
+            for addr, dst_keys in dst_flows.items():
+                src_keys = src_flows.get(addr)
+                if src_keys:
+                    flow_match.extend((src, dst) for src in src_keys for dst in dst_keys)
+        else:
+            for addr, src_keys in src_flows.items():
+                dst_keys = dst_flows.get(addr)
+                if dst_keys:
+                    flow_match.extend((src, dst) for src in src_keys for dst in dst_keys)
         return flow_match
 
+    def _index_flow(self, dpid, key):
+        in_port, out_port, eth_src, eth_dst = key
+        addr = (eth_src, eth_dst)
+        self.flow_out_index.setdefault(dpid, {}).setdefault(out_port, {}).setdefault(addr, set()).add(key)
+        self.flow_in_index.setdefault(dpid, {}).setdefault(in_port, {}).setdefault(addr, set()).add(key)
+
+    def _unindex_flow(self, dpid, key):
+        in_port, out_port, eth_src, eth_dst = key
+        addr = (eth_src, eth_dst)
+        for index, port in ((self.flow_out_index, out_port), (self.flow_in_index, in_port)):
+            port_index = index.get(dpid, {}).get(port)
+            if port_index is None or addr not in port_index:
+                continue
+            port_index[addr].discard(key)
+            if not port_index[addr]:
+                del port_index[addr]
+                if not port_index:
+                    del index[dpid][port]
 
-    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
     def _flow_stats_reply_handler(self, ev):
         """
             Save flow stats reply info into self.flow_stats.
@@ -132,40 +218,180 @@ class FlowStatistic(app_manager.RyuApp):
             [history][stat_type]
             As: (stat.packet_count, stat.byte_count, stat.duration_sec, stat.duration_nsec)
                         0                 1                 2                 3
+
+            A large table comes in several parts (OFPMPF_REPLY_MORE): every part is
+            saved as it arrives, the cycle only completes with the last one.
         """
-        body = ev.msg.body
-        dpid = ev.msg.datapath.id
+        msg = ev.msg
+        dpid = msg.datapath.id
 
-        self.flow_stats.setdefault(dpid, {})
-        self.delta_flow_stats.setdefault(dpid, {})
+        cycle = self.flow_cycle.get(dpid)
+        if cycle is None or cycle[0] != msg.xid:
+            # first part of a reply
+            self.flow_clock += 1
+            cycle = self.flow_cycle[dpid] = [msg.xid, self.flow_clock, 0, 0]
+        stamp = cycle[1]
 
-        # for stat in sorted([flow for flow in body if flow.priority > 0 and flow.priority < 65535],
-        #                    key=lambda flow: (flow.match.get('in_port'), flow.match.get('eth_dst'))):
-        
-        for stat in sorted([flow for flow in body if flow.priority == 1],
-                           key=lambda flow: (flow.match.get('in_port'), flow.match.get('eth_dst'))):
+        keys = []
+        values = []
+        for stat in msg.body:
+            if stat.priority != FLOW_STATS_PRIORITY:
+                continue
+            keys.append((stat.match['in_port'], stat.instructions[0].actions[0].port,
+                         stat.match.get('eth_src'), stat.match.get('eth_dst')))
+            values.append((stat.packet_count, stat.byte_count,
+                           stat.duration_sec, stat.duration_nsec))
+        entries = self.flow_entries.setdefault(dpid, {'received': 0, 'used': 0})
+        entries['received'] += len(msg.body)
+        entries['used'] += len(keys)
+        if keys:
+            activity = self._save_flow_stats(dpid, keys, np.array(values, dtype=np.uint64), stamp)
+            cycle[2] += len(keys)
+            cycle[3] = max(cycle[3], activity)
 
-            key = (stat.match['in_port'], stat.instructions[0].actions[0].port,
-                   stat.match.get('eth_src'), stat.match.get('eth_dst'))
+        if not msg.flags & ofproto_v1_3.OFPMPF_REPLY_MORE:
+            self._complete_cycle(dpid)
+
+    def _complete_cycle(self, dpid):
+        """
+            Last part of a reply arrived: every flow of the datapath has been seen.
+        """
+        _, stamp, entries, activity = self.flow_cycle.pop(dpid)
 
-            value = (stat.packet_count, stat.byte_count,
-                     stat.duration_sec, stat.duration_nsec)
+        # Flows missing from the reply expired or were deleted
+        if dpid in self.flow_stats:
+            stale = self.flow_stats[dpid].stale(stamp)
+            self._evict_flows(dpid, stale)
+            if stale:
+                activity = max(activity, len(stale) / (len(stale) + entries))
+        self.collector.report_activity(FLOW_STATS, dpid, activity)
+        self._enforce_flow_cap()
 
-            # Monitoring current flow.
-            self._save_stats(self.flow_stats[dpid], key, value, 5)
-            flow_stats = self.flow_stats[dpid][key]
+    def _save_flow_stats(self, dpid, keys, values, stamp):
+        """
+            Save one sample per flow key and compute deltas and rates at once.
+            Returns the activity of the datapath for the stats collector, in [0, 1]:
+            the share of new flows or the highest relative change of a flow's packet rate.
+        """
+        if dpid not in self.flow_stats:
+            self.flow_stats[dpid] = StatHistory(FLOW_STAT_COLUMNS, 5)
+            self.delta_flow_stats[dpid] = StatHistory(FLOW_STAT_COLUMNS, 5, np.int64)
+        flow_stats = self.flow_stats[dpid]
+        delta_flow_stats = self.delta_flow_stats[dpid]
 
-            if len(flow_stats) == 1:
-                self._save_stats(self.delta_flow_stats[dpid], key, (stat.packet_count, stat.byte_count, stat.duration_sec, stat.duration_nsec), 5)
+        # Monitoring current flow, the whole reply at once.
+        rows = flow_stats.append_batch(keys, values, stamp)
+        first = flow_stats.count[rows] == 1
 
-            if len(flow_stats) > 1:
-                # for future use
-                period = self._get_period(flow_stats[-1][2], flow_stats[-1][3],
-                                          flow_stats[-2][2], flow_stats[-2][3])
-        
-                # Get delta flow stat
-                self._save_stats(self.delta_flow_stats[dpid], key, tuple(map(operator.sub, flow_stats[-1], flow_stats[-2])), 5)
+        # Get delta flow stat: a flow seen for the first time keeps its raw counters
+        prev = flow_stats.take(rows, 2)
+        prev[first] = 0
+        delta = counter_delta(values, prev)
+        delta_flow_stats.append_batch(keys, delta, stamp)
+
+        # New flows join the link endpoint index
+        for key, new in zip(keys, first.tolist()):
+            if new:
+                self._index_flow(dpid, key)
+
+        # packet and byte rate over the period between the two samples
+        period = delta[:, 2] + delta[:, 3] / (10 ** 9)
+        valid = ~first & (period > 0)
+        rates = np.divide(delta[:, :2], period[:, None],
+                          out=np.full((len(keys), 2), np.nan), where=valid[:, None])
+        flow_speed = self.flow_speed.setdefault(dpid, {})
+        activity = float(first.mean())
+        for key, ok, rate in zip(keys, valid.tolist(), rates.tolist()):
+            if ok:
+                prev = flow_speed.get(key)
+                if prev is not None and max(prev[0], rate[0]) > 0:
+                    activity = max(activity, abs(rate[0] - prev[0]) / max(prev[0], rate[0]))
+                flow_speed[key] = tuple(rate)
+        return activity
+
+    def _evict_flows(self, dpid, keys):
+        for key in keys:
+            self.flow_stats[dpid].remove(key)
+            self.delta_flow_stats[dpid].remove(key)
+            self.flow_speed.get(dpid, {}).pop(key, None)
+            self._unindex_flow(dpid, key)
+
+    def _enforce_flow_cap(self):
+        """
+            Evict the least recently updated flows once FLOW_STATS_MAX_ENTRIES is exceeded.
+            Evicts down to 90% of the cap so the scan is not repeated on every reply.
+        """
+        total = sum(len(history) for history in self.flow_stats.values())
+        if total <= FLOW_STATS_MAX_ENTRIES:
+            return
+
+        excess = total - int(FLOW_STATS_MAX_ENTRIES * 0.9)
+        oldest = sorted((stamp, dpid, key)
+                        for dpid, history in self.flow_stats.items()
+                        for stamp, key in history.oldest(excess))
+        evict = {}
+        for _, dpid, key in oldest[:excess]:
+            evict.setdefault(dpid, []).append(key)
+        for dpid, keys in evict.items():
+            self._evict_flows(dpid, keys)
+        self.logger.info('flow stats over cap: evicted %d entries', excess)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        """
+            Record the final counters of a removed flow (OFPFF_SEND_FLOW_REM).
+            It is evicted with the next reply of the datapath, which no longer lists it.
+        """
+        msg = ev.msg
+        dpid = msg.datapath.id
+        if msg.priority != FLOW_STATS_PRIORITY or dpid not in self.flow_stats:
+            return
+
+        key = self._removed_flow_key(dpid, msg.match)
+        if key is None:
+            return
+        value = (msg.packet_count, msg.byte_count, msg.duration_sec, msg.duration_nsec)
+        self._save_flow_stats(dpid, [key], np.array([value], dtype=np.uint64), self.flow_clock)
+
+    def _removed_flow_key(self, dpid, match):
+        """
+            Flow key of a removed flow's match, None if no flow has exactly this match.
+            Flows are matched on exactly (in_port, eth_src, eth_dst): one entry per match,
+            but a re-installed flow with a new out_port leaves the old key until the
+            next reply, so the most recently updated one is taken.
+        """
+        fields = dict(match.items())
+        in_port, eth_src, eth_dst = fields.get('in_port'), fields.get('eth_src'), fields.get('eth_dst')
+        if fields != {'in_port': in_port, 'eth_src': eth_src, 'eth_dst': eth_dst}:
+            return None
+        keys = self.flow_in_index.get(dpid, {}).get(in_port, {}).get((eth_src, eth_dst), ())
+        flow_stats = self.flow_stats[dpid]
+        keys = [key for key in keys if key[0] == in_port and key[2:] == (eth_src, eth_dst)]
+        if not keys:
+            return None
+        return max(keys, key=lambda key: flow_stats.stamp[flow_stats.rows[key]])
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        """
+            Drop everything known about a datapath that went away.
+        """
+        dpid = ev.datapath.id
+        if ev.state != DEAD_DISPATCHER or dpid is None:
+            return
+        for store in (self.flow_stats, self.delta_flow_stats, self.flow_speed,
+                      self.flow_out_index, self.flow_in_index, self.flow_cycle, self.flow_entries,
+                      self.aggregate_targets):
+            store.pop(dpid, None)
+        for key in [key for key in self.aggregate_stats if key[0] == dpid]:
+            del self.aggregate_stats[key]
     
+    def get_flow_entry_stats(self):
+        """
+            Flow entries received in replies against entries used, per datapath.
+        """
+        return self.flow_entries
+
     def get_flow_stats(self, dpid=None):
         if self.flow_stats is None: return None
         stat = []
@@ -173,7 +399,7 @@ class FlowStatistic(app_manager.RyuApp):
         for dpid in flow_stats:
             for flow_name in flow_stats[dpid]:
                 in_port, out_port, eth_src, eth_dst = flow_name
-                packet_count, byte_count, duration_sec, duration_nsec = flow_stats[dpid][flow_name][-1]
+                packet_count, byte_count, duration_sec, duration_nsec = flow_stats[dpid].last(flow_name)
                 stat.append({
                     'dpid': dpid,
                     'in_port': in_port,
@@ -187,6 +413,22 @@ class FlowStatistic(app_manager.RyuApp):
                 })
         return stat
     
+    def get_flow_speed(self, dpid=None):
+        stat = []
+        for dpid in self.flow_speed:
+            for flow_name, (packet_rate, byte_rate) in self.flow_speed[dpid].items():
+                in_port, out_port, eth_src, eth_dst = flow_name
+                stat.append({
+                    'dpid': dpid,
+                    'in_port': in_port,
+                    'out_port': out_port,
+                    'eth_src': eth_src,
+                    'eth_dst': eth_dst,
+                    'packet_rate': packet_rate,
+                    'byte_rate': byte_rate,
+                })
+        return stat
+
     def get_delta_flow_stats(self, dpid=None):
         if self.delta_flow_stats is None: return None
         stat = []
@@ -194,7 +436,7 @@ class FlowStatistic(app_manager.RyuApp):
         for dpid in delta_flow_stat:
             for flow_name in delta_flow_stat[dpid]:
                 in_port, out_port, eth_src, eth_dst = flow_name
-                packet_count, byte_count, duration_sec, duration_nsec = self.delta_flow_stats[dpid][flow_name][-1]
+                packet_count, byte_count, duration_sec, duration_nsec = delta_flow_stat[dpid].last(flow_name)
                 stat.append({
                     'dpid': dpid,
                     'in_port': in_port,
@@ -208,4 +450,4 @@ class FlowStatistic(app_manager.RyuApp):
                 })
         return stat
 
-#  ryu-manager --observe-link --ofp-tcp-listen-port=6633 topology_data.py flow_statistic.py ryu.app.simple_switch_13
\ No newline at end of file
+#  ryu-manager --observe-link --ofp-tcp-listen-port=6633 topology_data.py stats_collector.py flow_statistic.py ryu.app.simple_switch_13
\ No newline at end of file
@@ -0,0 +1,161 @@
+# Dense per-link metric store shared by the monitoring apps
+import time
+import numpy as np
+
+# Metrics of a link, one float column each (nan: unknown)
+LINK_METRICS = ('lldpdelay', 'delay', 'delay_ewma', 'delay_min', 'delay_p50', 'delay_p95',
+                'delay_p99', 'delay_jitter', 'free_bandwidth', 'link_usage', 'packet_loss',
+                'probe_delay')
+
+
+class LinkMetricTable(object):
+    """
+        Metrics of every link in typed columns, one row per link:
+        a link keeps its row while it exists, rows of removed links are reused.
+
+        values[metric]: float64 column, nan when unknown.
+        updated[metric]: time of the last write of each row, nan if never written.
+        Writers set whole columns (set()) or single links (set_link()),
+        readers get views of the columns (column()), nothing is copied.
+        version is bumped on every change, to rebuild derived data lazily.
+    """
+
+    def __init__(self, metrics=LINK_METRICS, rows=64):
+        self.metrics = tuple(metrics)
+        self.values = {metric: np.full(rows, np.nan) for metric in self.metrics}
+        self.updated = {metric: np.full(rows, np.nan) for metric in self.metrics}
+        self.rows = {}                                  # {(src_dpid, dst_dpid): row}
+        self.row_links = [None] * rows                  # [row]: link
+        self.free_rows = list(range(rows - 1, -1, -1))  # unused rows, popped from the end
+        self.size = 0                                   # rows in use or freed: columns are cut here
+        self.version = 0
+        self._live = None                               # (rows, links) cache of live()
+
+    def __contains__(self, link):
+        return link in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _grow(self):
+        """
+            Double the number of rows, keeping the stored values.
+        """
+        rows = len(self.row_links)
+        for store in (self.values, self.updated):
+            for metric in self.metrics:
+                store[metric] = np.concatenate((store[metric], np.full(rows, np.nan)))
+        self.row_links.extend([None] * rows)
+        self.free_rows.extend(range(2 * rows - 1, rows - 1, -1))
+
+    def add(self, link):
+        """
+            Row of link, allocated with unknown metrics on first use.
+        """
+        row = self.rows.get(link)
+        if row is None:
+            if not self.free_rows:
+                self._grow()
+            row = self.free_rows.pop()
+            self.rows[link] = row
+            self.row_links[row] = link
+            self.size = max(self.size, row + 1)
+            self._live = None
+            self.version += 1
+        return row
+
+    def remove(self, link):
+        row = self.rows.pop(link, None)
+        if row is not None:
+            for metric in self.metrics:
+                self.values[metric][row] = np.nan
+                self.updated[metric][row] = np.nan
+            self.row_links[row] = None
+            self.free_rows.append(row)
+            self._live = None
+            self.version += 1
+
+    def live(self):
+        """
+            (rows, links) of the existing links: int array, list aligned with it.
+        """
+        if self._live is None:
+            rows = np.array(sorted(self.rows.values()), dtype=np.int64)
+            self._live = (rows, [self.row_links[row] for row in rows.tolist()])
+        return self._live
+
+    def lookup(self, links):
+        """
+            Rows of links as an int array, -1 for unknown links.
+        """
+        rows = self.rows
+        return np.fromiter((rows.get(link, -1) for link in links), dtype=np.int64, count=len(links))
+
+    def column(self, metric):
+        """
+            View of a metric column, indexed by row. Read only.
+        """
+        return self.values[metric][:self.size]
+
+    def set(self, metric, rows, values, now=None):
+        """
+            Write values of a metric for rows at once; rows < 0 are skipped.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        known = rows >= 0
+        if not known.all():
+            rows = rows[known]
+            values = values[known] if values.ndim else values
+        self.values[metric][rows] = values
+        self.updated[metric][rows] = time.time() if now is None else now
+        self.version += 1
+
+    def set_link(self, metric, link, value, now=None):
+        """
+            Write the metric of one link, ignored if the link is unknown.
+        """
+        row = self.rows.get(link)
+        if row is None:
+            return False
+        self.values[metric][row] = np.nan if value is None else value
+        self.updated[metric][row] = time.time() if now is None else now
+        self.version += 1
+        return True
+
+    def get(self, metric, link):
+        """
+            Metric of one link, None if unknown.
+        """
+        row = self.rows.get(link)
+        if row is None:
+            return None
+        value = self.values[metric][row]
+        return None if np.isnan(value) else float(value)
+
+    def records(self, metrics=None):
+        """
+            (links, {metric: [value or None,...]}) of the existing links, for json.
+        """
+        rows, links = self.live()
+        metrics = self.metrics if metrics is None else metrics
+        records = {}
+        for metric in metrics:
+            column = self.values[metric][rows]
+            values = column.tolist()
+            if np.isnan(column).any():
+                values = [None if value != value else value for value in values]
+            records[metric] = values
+        return links, records
+
+    def materialize(self, graph):
+        """
+            Write the metrics of every link present in graph as edge attributes.
+        """
+        links, records = self.records()
+        adj = graph.adj
+        for i, (src, dst) in enumerate(links):
+            edge = adj.get(src, {}).get(dst)
+            if edge is not None:
+                for metric, values in records.items():
+                    edge[metric] = values[i]
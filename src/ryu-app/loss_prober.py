@@ -0,0 +1,358 @@
+# Base
+from ryu.base import app_manager
+from ryu.base.app_manager import lookup_service_brick
+from ryu.controller import ofp_event
+from ryu.controller.handler import set_ev_cls, MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.ofproto import ofproto_v1_3
+
+# Thread
+from ryu.lib import hub
+from ryu.lib import addrconv
+from ryu.lib.packet import packet, ethernet, lldp
+from ryu.ofproto.ether import ETH_TYPE_LLDP
+from ryu.topology.switches import LLDPPacket
+
+import random
+import struct
+import time
+import numpy as np
+
+from setting import LOSS_PROBER, TOPOLOGY_DATA, DELAY_MONITOR, LINK_LOSS_MODE, LINK_LOSS_MODES, \
+    LOSS_PROBE_INTERVAL, LOSS_PROBE_TRAIN, LOSS_PROBE_MAX_PPS, LOSS_PROBE_TIMEOUT
+from stats_scheduler import RequestBudget
+from topology_data import TopologyData
+from snapshot import snapshots
+
+
+class ProbeTrain(object):
+    """
+        Probes of one train sent through a link, and the ones received back.
+    """
+
+    def __init__(self, train_id, size):
+        self.train_id = train_id
+        self.size = size
+        self.sent = 0
+        self.last_send = None
+        self.received = set() # {seq,...}
+        self.delays = []      # [recv - send time (s),...]
+
+
+class LossProber(app_manager.RyuApp):
+    """
+        Measure link loss and one-way delay with probe trains.
+
+        Probes are LLDP frames to the 01:80:c2:00:00:03 group address, so
+        Switches leaves them alone and simple_switch_13 does not flood them.
+        Each one is sent out of the link's src port by packet-out; a flow
+        installed on the dst switch of every link in 'probe' loss mode returns
+        it to the controller. The probe TLV carries (src_dpid, src_port,
+        train, seq, send time in ns).
+
+        Nothing runs unless 'probe' loss mode is configured. A train sends at
+        most one probe per TICK, and all trains together stay within
+        LOSS_PROBE_MAX_PPS paced per tick, not in bursts.
+    """
+
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    PROBE_MAC = '01:80:c2:00:00:03'
+    PROBE_MAC_BIN = addrconv.mac.text_to_bin(PROBE_MAC)
+    PROBE_SRC_MAC = '02:00:00:00:00:01'
+    PROBE_FLOW_PRIORITY = 0xFFFF
+
+    # Organizationally specific TLV, LLDPPacket.PROBE_OUI with its own subtype
+    PROBE_SUBTYPE = 2
+    PROBE_HEADER = LLDPPacket.PROBE_OUI + struct.pack('!B', PROBE_SUBTYPE)
+    PROBE_STR = '!QIIIQ'    # src_dpid, src_port, train id, seq, send time (ns)
+    PROBE_SIZE = struct.calcsize(PROBE_STR)
+
+    TICK = 0.01      # while trains are sending or waiting for their probes
+    IDLE_TICK = 1    # longest sleep while no train is in progress
+
+    def __init__(self, *args, **kwargs):
+        super(LossProber, self).__init__(*args, **kwargs)
+        self.name = LOSS_PROBER
+
+        self.topology_data: TopologyData = lookup_service_brick(TOPOLOGY_DATA)
+        # no more than one tick's worth of probes at once
+        self.budget = RequestBudget(LOSS_PROBE_MAX_PPS, max(1, LOSS_PROBE_MAX_PPS * self.TICK)) \
+            if LOSS_PROBE_MAX_PPS else None
+
+        self.frames = {}      # {(src_dpid, src_port): (bytearray, offset)} - probe frame, offset of the probe TLV info
+        self.trains = {}      # {(src_dpid, dst_dpid): ProbeTrain} - train in progress
+        self.next_train = {}  # {(src_dpid, dst_dpid): time of the next train}
+        self.train_id = 0
+        self.probe_stats = {} # {(src_dpid, dst_dpid): result of the latest train}
+        self.links = []       # links in 'probe' loss mode
+        self.links_version = None # topology version self.links was built from
+        self.flow_dpids = set() # datapaths with the probe flow installed
+        self.flows_synced = False # flow_dpids matches the dst switches of self.links
+        self.send_turn = 0    # round robin start of _send_probes
+
+        self.probe_thread = hub.spawn(self._probe_thread) if self._probing() else None
+
+    def start(self):
+        snapshots.publish('probe_stat', self.get_probe_stats())
+        return super(LossProber, self).start()
+
+    def _probing(self):
+        """
+            True if any link can be in 'probe' loss mode.
+        """
+        return LINK_LOSS_MODE == 'probe' or 'probe' in LINK_LOSS_MODES.values()
+
+    # Thread:
+    def _probe_thread(self):
+        while True:
+            wait = self.IDLE_TICK
+            try:
+                now = time.time()
+                self._start_trains(now)
+                self._send_probes()
+                self._finish_trains(now)
+                wait = self._next_wakeup(now)
+            except:
+                if self.topology_data is None:
+                    self.topology_data = lookup_service_brick(TOPOLOGY_DATA)
+                else:
+                    self.logger.exception('loss probing failed')
+            hub.sleep(wait)
+
+    def _next_wakeup(self, now):
+        """
+            Seconds to sleep: a tick while a train is in progress, else until
+            the next train is due.
+        """
+        if self.trains:
+            return self.TICK
+        if not self.next_train:
+            return self.IDLE_TICK
+        return min(max(min(self.next_train.values()) - now, self.TICK), self.IDLE_TICK)
+
+    def _probe_links(self):
+        if self.links_version != self.topology_data.topology_version:
+            self.links_version = self.topology_data.topology_version
+            link_to_port = self.topology_data.link_to_port
+            self.links = [link for link in link_to_port
+                          if LINK_LOSS_MODES.get(link, LINK_LOSS_MODE) == 'probe']
+            # frames of ports no longer probed
+            ports = set((link[0], link_to_port[link][0]) for link in self.links)
+            for port in set(self.frames).difference(ports):
+                del self.frames[port]
+            self.flows_synced = False
+        if not self.flows_synced:
+            self.flows_synced = self._sync_probe_flows()
+        return self.links
+
+    def _sync_probe_flows(self):
+        """
+            Install the probe flow on the dst switch of every probed link,
+            remove it from the others.
+            Returns False if a switch is not connected yet, to retry.
+        """
+        datapaths = self.topology_data.datapaths
+        dpids = set(dst for _, dst in self.links)
+        for dpid in dpids.difference(self.flow_dpids):
+            if dpid in datapaths:
+                self._probe_flow(datapaths[dpid], add=True)
+                self.flow_dpids.add(dpid)
+        for dpid in self.flow_dpids.difference(dpids):
+            if dpid in datapaths:
+                self._probe_flow(datapaths[dpid], add=False)
+            self.flow_dpids.discard(dpid)
+        return dpids.issubset(self.flow_dpids)
+
+    def _start_trains(self, now):
+        links = self._probe_links()
+        for link in links:
+            if link not in self.next_train:
+                # spread the trains of the links over the interval
+                self.next_train[link] = now + random.uniform(0, LOSS_PROBE_INTERVAL)
+            elif link not in self.trains and self.next_train[link] <= now:
+                self.train_id = (self.train_id + 1) & 0xffffffff
+                self.trains[link] = ProbeTrain(self.train_id, LOSS_PROBE_TRAIN)
+                self.next_train[link] = now + LOSS_PROBE_INTERVAL
+        for link in set(self.next_train).difference(links):
+            self.next_train.pop(link)
+            self.trains.pop(link, None)
+
+    def _send_probes(self):
+        """
+            Send the next probe of every pending train, round robin, within the budget.
+            Called every tick: a train's probes are spread over its ticks.
+        """
+        pending = [(link, train) for link, train in self.trains.items() if train.sent < train.size]
+        if not pending:
+            return
+        # start where the budget ran out last tick
+        start = self.send_turn % len(pending)
+        for i in range(len(pending)):
+            if self.budget is not None and not self.budget.take():
+                self.send_turn = start + i
+                return
+            self._send_probe(*pending[(start + i) % len(pending)])
+        self.send_turn = 0
+
+    def _send_probe(self, link, train):
+        src_dpid, _ = link
+        src_port, _ = self.topology_data.link_to_port[link]
+        datapath = self.topology_data.datapaths.get(src_dpid)
+        if datapath is None:
+            # cut the train short
+            train.size = train.sent
+            return
+        seq = train.sent
+        train.sent += 1
+
+        if (src_dpid, src_port) not in self.frames:
+            frame = self._probe_frame(src_dpid, src_port)
+            self.frames[(src_dpid, src_port)] = (frame, frame.rindex(self.PROBE_HEADER) + len(self.PROBE_HEADER))
+        frame, offset = self.frames[(src_dpid, src_port)]
+        send_time = time.time_ns()
+        struct.pack_into(self.PROBE_STR, frame, offset,
+                         src_dpid, src_port, train.train_id, seq, send_time)
+        train.last_send = send_time / 10 ** 9
+
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        actions = [parser.OFPActionOutput(src_port)]
+        out = parser.OFPPacketOut(datapath=datapath, buffer_id=ofproto.OFP_NO_BUFFER,
+                                  in_port=ofproto.OFPP_CONTROLLER, actions=actions,
+                                  data=bytes(frame))
+        datapath.send_msg(out)
+
+    def _probe_frame(self, src_dpid, src_port):
+        """
+            Probe frame of a port with a blank probe TLV, stamped per send.
+        """
+        pkt = packet.Packet()
+        pkt.add_protocol(ethernet.ethernet(self.PROBE_MAC, self.PROBE_SRC_MAC, ETH_TYPE_LLDP))
+        pkt.add_protocol(lldp.lldp((
+            lldp.ChassisID(subtype=lldp.ChassisID.SUB_LOCALLY_ASSIGNED,
+                           chassis_id=('probe:%016x' % src_dpid).encode('ascii')),
+            lldp.PortID(subtype=lldp.PortID.SUB_PORT_COMPONENT,
+                        port_id=struct.pack(LLDPPacket.PORT_ID_STR, src_port)),
+            lldp.TTL(ttl=0),
+            lldp.OrganizationallySpecific(oui=LLDPPacket.PROBE_OUI, subtype=self.PROBE_SUBTYPE,
+                                          info=bytes(self.PROBE_SIZE)),
+            lldp.End(),
+        )))
+        pkt.serialize()
+        return bytearray(pkt.data)
+
+    def _finish_trains(self, now):
+        finished = False
+        for link, train in list(self.trains.items()):
+            if train.sent == 0 and train.size == 0:
+                del self.trains[link]
+                continue
+            if train.sent < train.size or now - train.last_send < LOSS_PROBE_TIMEOUT:
+                continue
+            del self.trains[link]
+            self._save_train(link, train)
+            finished = True
+        if finished:
+            self._publish_snapshot()
+
+    def _publish_snapshot(self):
+        """
+            Publish the probe stats of the finished trains.
+        """
+        snapshots.publish('probe_stat', self.get_probe_stats())
+
+    def _save_train(self, link, train):
+        """
+            Loss and one-way delay distribution of a finished train.
+            The delay of the control channel at both ends (half of their echo
+            rtt) is taken out when the delay monitor knows it.
+        """
+        src_dpid, dst_dpid = link
+        result = {
+            'sent': train.sent,
+            'received': len(train.received),
+            'loss': 1 - len(train.received) / train.sent,
+        }
+        if train.delays:
+            delays = np.array(train.delays)
+            delay_monitor = lookup_service_brick(DELAY_MONITOR)
+            if delay_monitor is not None and src_dpid in delay_monitor.echo_latency \
+                    and dst_dpid in delay_monitor.echo_latency:
+                delays -= (delay_monitor.echo_latency[src_dpid] + delay_monitor.echo_latency[dst_dpid]) / 2
+            delays = np.maximum(delays, 0) * 1000 # ms
+            p50, p95, p99 = np.percentile(delays, (50, 95, 99)).tolist()
+            result.update({
+                'delay_min': float(delays.min()),
+                'delay_mean': float(delays.mean()),
+                'delay_p50': p50,
+                'delay_p95': p95,
+                'delay_p99': p99,
+                'delay_max': float(delays.max()),
+            })
+        self.probe_stats[link] = result
+
+        link_metrics = self.topology_data.link_metrics
+        link_metrics.set_link('packet_loss', link, result['loss'])
+        link_metrics.set_link('probe_delay', link, result.get('delay_p50'))
+
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def _packet_in_handler(self, ev):
+        """
+            Account a probe back from the dst switch of its link.
+        """
+        recv_time = time.time_ns()
+        data = ev.msg.data
+        if data[:6] != self.PROBE_MAC_BIN:
+            return
+        offset = data.rfind(self.PROBE_HEADER)
+        if offset < 0:
+            return
+        src_dpid, src_port, train_id, seq, send_time = \
+            struct.unpack_from(self.PROBE_STR, data, offset + len(self.PROBE_HEADER))
+
+        link = (src_dpid, ev.msg.datapath.id)
+        train = self.trains.get(link)
+        if train is None or train.train_id != train_id or seq in train.received:
+            # late or duplicated
+            return
+        train.received.add(seq)
+        train.delays.append((recv_time - send_time) / 10 ** 9)
+
+    def _probe_flow(self, datapath, add):
+        """
+            Add or delete the flow returning the probes arriving at a switch to the controller.
+        """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        match = parser.OFPMatch(eth_type=ETH_TYPE_LLDP, eth_dst=self.PROBE_MAC)
+        if add:
+            actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
+            inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+            mod = parser.OFPFlowMod(datapath=datapath, match=match, idle_timeout=0, hard_timeout=0,
+                                    instructions=inst, priority=self.PROBE_FLOW_PRIORITY)
+        else:
+            mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE_STRICT,
+                                    out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                    match=match, priority=self.PROBE_FLOW_PRIORITY)
+        datapath.send_msg(mod)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        """
+            A switch that (re)connects has no probe flow yet: install it with
+            the next sync of the probed links.
+        """
+        self.flow_dpids.discard(ev.datapath.id)
+        self.flows_synced = False
+
+    """
+        Accessor:
+        return info as dict
+    """
+    def get_probe_stats(self):
+        stats = []
+        for (src_dpid, dst_dpid), result in self.probe_stats.items():
+            stats.append(dict(result, src_dpid=src_dpid, dst_dpid=dst_dpid))
+        return stats
+
+# ryu-manager --observe-link --ofp-tcp-listen-port=6633 topology_data.py stats_collector.py delay_monitor.py loss_prober.py
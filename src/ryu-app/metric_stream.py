@@ -0,0 +1,239 @@
+# Push of the metric updates of every cycle to stream clients
+import json
+from urllib.parse import parse_qs
+
+from ryu.lib import hub
+
+from setting import STREAM_QUEUE_SIZE
+
+# Streamed resources: fields identifying an item of their snapshot
+STREAM_KEYS = {
+    'link_quality': ('src.dpid', 'dst.dpid'),
+    'delay_stat': ('src_dpid', 'dst_dpid'),
+    'probe_stat': ('src_dpid', 'dst_dpid'),
+    'port_stat': ('dpid', 'port_no'),
+    'delta_port_stat': ('dpid', 'port_no'),
+    'flow_stat': ('dpid', 'in_port', 'out_port', 'eth_src', 'eth_dst'),
+    'delta_flow_stat': ('dpid', 'in_port', 'out_port', 'eth_src', 'eth_dst'),
+    'flow_speed': ('dpid', 'in_port', 'out_port', 'eth_src', 'eth_dst'),
+}
+
+# Item fields holding a datapath id, for the dpid filter
+DPID_FIELDS = ('dpid', 'src.dpid', 'dst.dpid', 'src_dpid', 'dst_dpid')
+
+
+class StreamFilter(object):
+    """
+        Part of the updates a client wants, None: everything.
+        resources: streamed resource names
+        dpids: items of these datapaths (either end of a link)
+        metrics: items where one of these fields changed, sent with only
+                 them and their key fields
+    """
+
+    def __init__(self, resources=None, dpids=None, metrics=None):
+        self.resources = resources
+        self.dpids = dpids
+        self.metrics = metrics
+
+    @classmethod
+    def parse(cls, fields):
+        """
+            Filter from {'resource', 'dpid', 'metric'}: lists, or comma separated
+            strings as in a query string. dpids are decimal or 0x prefixed hex.
+        """
+        def values(name):
+            value = fields.get(name)
+            if value is None:
+                return None
+            if isinstance(value, str):
+                value = value.split(',')
+            return [v for v in value if v != '']
+
+        resources = values('resource')
+        dpids = values('dpid')
+        metrics = values('metric')
+        return cls(set(resources) if resources else None,
+                   set(dpid if isinstance(dpid, int) else int(dpid, 0) for dpid in dpids) if dpids else None,
+                   set(metrics) if metrics else None)
+
+    def unfiltered(self):
+        return self.resources is None and self.dpids is None and self.metrics is None
+
+    def apply(self, name, key_fields, changed, removed):
+        """
+            (changed items, removed keys) of the resource name this filter lets through.
+            changed: [(previous item or None, item),...], removed: [key dict,...]
+        """
+        if self.resources is not None and name not in self.resources:
+            return [], []
+        dpids = self.dpids
+        metrics = self.metrics
+        items = []
+        for previous, item in changed:
+            if dpids is not None and not any(item.get(field) in dpids for field in DPID_FIELDS):
+                continue
+            if metrics is not None:
+                fields = [metric for metric in metrics if metric in item]
+                if not fields:
+                    continue
+                if previous is not None and all(previous.get(metric) == item[metric] for metric in fields):
+                    continue
+                projected = {field: item[field] for field in key_fields}
+                projected.update((metric, item[metric]) for metric in fields)
+                item = projected
+            items.append(item)
+        if dpids is not None:
+            removed = [key for key in removed if any(key.get(field) in dpids for field in DPID_FIELDS)]
+        return items, removed
+
+
+class StreamClient(object):
+    """
+        A stream subscriber: its filter and bounded queue of encoded messages.
+    """
+
+    def __init__(self, stream_filter, queue_size=STREAM_QUEUE_SIZE):
+        self.filter = stream_filter
+        self.queue = hub.Queue(maxsize=queue_size)
+        self.closed = False
+        self.sent = 0
+
+
+class MetricStream(object):
+    """
+        Turns every published snapshot of a streamed resource into a delta
+        against the previous one (items added or changed, keys removed) and
+        queues it, filtered, for every client.
+
+        Messages: {'resource', 'version', 'timestamp', 'changed': [item,...],
+        'removed': [key,...]}. Nothing is computed while no client is
+        connected. Queuing never blocks the publishing app: a client whose
+        queue is full is dropped.
+    """
+
+    def __init__(self, snapshots, queue_size=STREAM_QUEUE_SIZE):
+        self.snapshots = snapshots
+        self.queue_size = queue_size
+        self.clients = set()
+        self.dropped = 0
+        snapshots.add_listener(self._snapshot_published)
+
+    def connect(self, stream_filter):
+        client = StreamClient(stream_filter, self.queue_size)
+        self.clients.add(client)
+        return client
+
+    def disconnect(self, client):
+        client.closed = True
+        self.clients.discard(client)
+
+    def _snapshot_published(self, previous, snapshot):
+        key_fields = STREAM_KEYS.get(snapshot.name)
+        if key_fields is None or not self.clients:
+            return
+        changed, removed = self._diff(key_fields, previous.data if previous is not None else (), snapshot.data)
+        if not changed and not removed:
+            return
+
+        shared = None # message of the unfiltered clients, encoded once
+        for client in list(self.clients):
+            if client.filter.unfiltered():
+                if shared is None:
+                    shared = self._message(snapshot, [item for _, item in changed], removed)
+                message = shared
+            else:
+                items, keys = client.filter.apply(snapshot.name, key_fields, changed, removed)
+                if not items and not keys:
+                    continue
+                message = self._message(snapshot, items, keys)
+            if client.queue.qsize() >= self.queue_size:
+                # too slow: drop it rather than queue without bound
+                self.disconnect(client)
+                self.dropped += 1
+                continue
+            client.queue.put(message) # room left: does not block
+
+    def _diff(self, key_fields, old, new):
+        """
+            ([(previous item or None, item),...] of the items added or changed,
+             [key dict,...] of the items gone) between two snapshots.
+        """
+        old_items = {tuple(item[field] for field in key_fields): item for item in old}
+        changed = []
+        for item in new:
+            previous = old_items.pop(tuple(item[field] for field in key_fields), None)
+            if previous != item:
+                changed.append((previous, item))
+        removed = [dict(zip(key_fields, key)) for key in old_items]
+        return changed, removed
+
+    def _message(self, snapshot, changed, removed):
+        return json.dumps({
+            'resource': snapshot.name,
+            'version': snapshot.version,
+            'timestamp': snapshot.timestamp,
+            'changed': changed,
+            'removed': removed,
+        })
+
+    def serve(self, ws):
+        """
+            Stream to a websocket until it closes or is dropped.
+            The filter comes from the query string (?resource=..&dpid=..&metric=..)
+            and is replaced by every json object the client sends.
+        """
+        query = parse_qs(ws.environ.get('QUERY_STRING', ''))
+        try:
+            stream_filter = StreamFilter.parse({name: ','.join(value) for name, value in query.items()})
+        except ValueError:
+            ws.send(json.dumps({'error': 'invalid filter: %s' % ws.environ.get('QUERY_STRING')}))
+            ws.close()
+            return
+        client = self.connect(stream_filter)
+        reader = hub.spawn(self._read, ws, client)
+        try:
+            while not client.closed:
+                message = client.queue.get()
+                if client.closed or message is None:
+                    break
+                ws.send(message)
+                client.sent += 1
+        except Exception:
+            pass
+        finally:
+            self.disconnect(client)
+            hub.kill(reader)
+            ws.close()
+
+    def _read(self, ws, client):
+        """
+            Filter updates from the client, until it closes the socket.
+        """
+        try:
+            while True:
+                message = ws.wait()
+                if message is None:
+                    break
+                try:
+                    client.filter = StreamFilter.parse(json.loads(message))
+                except (ValueError, TypeError, AttributeError):
+                    ws.send(json.dumps({'error': 'invalid filter: %s' % message}))
+        except Exception:
+            pass
+        self.disconnect(client)
+        if client.queue.qsize() < self.queue_size:
+            # wake up the sender
+            client.queue.put(None)
+
+    """
+        Accessor:
+        return info as dict
+    """
+    def get_stream_stats(self):
+        return {
+            'clients': len(self.clients),
+            'dropped': self.dropped,
+            'queued': [client.queue.qsize() for client in self.clients],
+            'sent': [client.sent for client in self.clients],
+        }
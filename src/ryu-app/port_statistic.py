@@ -1,22 +1,28 @@
 # Base
 from ryu.base import app_manager
 from ryu.base.app_manager import lookup_service_brick
-from setting import GRAPH_UPDATE_INTERVAL, STATS_REQUEST_INTERVAL, PORT_STATISTIC, TOPOLOGY_DATA
+from setting import GRAPH_UPDATE_INTERVAL, STATS_REQUEST_INTERVAL, PORT_STATISTIC, TOPOLOGY_DATA, PORT_STATS_MAX_ENTRIES, \
+    PORT_DESC_RECONCILE_INTERVAL, STATS_COLLECTOR, STATS_MAX_INTERVAL, LINK_LOSS_MODE, LINK_LOSS_MODES
 
 # Ofp
 from ryu.controller import ofp_event
-from ryu.controller.handler import set_ev_cls, MAIN_DISPATCHER
+from ryu.controller.handler import set_ev_cls, MAIN_DISPATCHER, DEAD_DISPATCHER
 
 # Thread
 from ryu.lib import hub
 from ryu.ofproto import ofproto_v1_3
 
 # Extra
-import operator
-from operator import attrgetter
+import numpy as np
 
 # External:
 from topology_data import TopologyData
+from stat_history import StatHistory, counter_delta
+from stats_collector import StatsCollector, PORT_STATS, PORT_DESC
+from snapshot import snapshots
+
+PORT_STAT_COLUMNS = ('tx_packets', 'rx_packets', 'tx_bytes', 'rx_bytes',
+                     'rx_errors', 'duration_sec', 'duration_nsec')
 
 class PortStatistic(app_manager.RyuApp):
 
@@ -27,172 +33,269 @@ class PortStatistic(app_manager.RyuApp):
 
         # Get data from another modules.
         self.topology_data: TopologyData = lookup_service_brick(TOPOLOGY_DATA)
+        self.collector: StatsCollector = None
         
         # Thread
-        self.monitor_thread = hub.spawn(self._monitor_thread)
         self.save_freebandwidth_thread = hub.spawn(self._save_bw_graph)
 
         """ _port_stat_reply_handle """
-        self.port_stats = {} # {(dpid port_no): [(tx_packets, rx_packets ,tx_bytes, rx_bytes, rx_errors, duration_sec, duration_nsec),...]}
-        self.delta_port_stats = {} # {(dpid, port_no): [(delta_upload, delta_download, delta_error, period),... ]},... }
+        self.port_stats = StatHistory(PORT_STAT_COLUMNS, 5) # {(dpid port_no): ring of (tx_packets, rx_packets ,tx_bytes, rx_bytes, rx_errors, duration_sec, duration_nsec)}
+        self.delta_port_stats = StatHistory(PORT_STAT_COLUMNS, 5, np.int64) # {(dpid, port_no): ring of deltas of the port_stats columns}
+        self.port_nos = {} # {dpid: {port_no,...}} ports listed in the latest reply
+        self.port_cycle = {} # {dpid: [xid, {port_no,...}]} - multipart reply still arriving, ports listed so far
+        self.port_clock = 0 # bumped per reply, stamps port entries for LRU eviction
         
         """ _create_bandwidth_graph """
         self.free_bandwidth = {} # {dpid: {port_no: (free_bandwidth, usage), ...}, ...}} (Mbit/s)
 
-        """ _port_desc_stats_reply_handler """
-        self.port_features = {}
+        """ _port_desc_stats_reply_handler, _port_status_handler """
+        self.port_features = {} # {dpid: {port_no: (config, state, curr_speed)}}
 
-    # Thread:
-    def _monitor_thread(self):
-        while True:            
-            try:
-                for dp in self.topology_data.datapaths.values():
-                    self.port_features.setdefault(dp.id, {})
-                    self._request_stats(dp)
-                hub.sleep(STATS_REQUEST_INTERVAL)
-            except:
-                if self.topology_data is None:
-                    self.topology_api_app = lookup_service_brick(TOPOLOGY_DATA)
-                    self.logger.info('update topology data')
+    def start(self):
+        """
+            Polling is done by the stats collector: subscribe once every app is up.
+            Port features follow port status messages, the port description
+            is fetched on connect and every PORT_DESC_RECONCILE_INTERVAL only
+            to reconcile missed ones.
+        """
+        self.collector = lookup_service_brick(STATS_COLLECTOR)
+        self.collector.subscribe(PORT_STATS, self._port_stats_reply_handler, STATS_MAX_INTERVAL)
+        self.collector.subscribe(PORT_DESC, self._port_desc_stats_reply_handler, PORT_DESC_RECONCILE_INTERVAL)
+        self._publish_snapshot()
+        return super(PortStatistic, self).start()
 
+    # Thread:
     def _save_bw_graph(self):
         """
-            Save bandwidth data into networkx graph object.
+            Save bandwidth and port loss data into the link metrics.
         """
         while True:
-            self.graph = self._create_bandwidth_graph(self.free_bandwidth)
+            self._create_bandwidth_graph(self.free_bandwidth)
             self.logger.debug("save_freebandwidth")
+            self._save_port_loss()
+            self._publish_snapshot()
             hub.sleep(GRAPH_UPDATE_INTERVAL)
 
-    # Stat request:
-    def _request_stats(self, datapath):
-        self.logger.debug('send stats request: %016x', datapath.id)
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
-
-        req = parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY)
-        datapath.send_msg(req)
-
-        req = parser.OFPPortDescStatsRequest(datapath, 0)
-        datapath.send_msg(req)
-
-    # 
-    def _save_stats(self, _dict, key, value, history_length=2):
-        if key not in _dict:
-            _dict[key] = []
-        _dict[key].append(value)
-
-        if len(_dict[key]) > history_length:
-            _dict[key].pop(0)
-
-    def _cal_delta_stat(self, now, pre, period):
-        if period: return (now - pre) / (period)
-        else: return
-
-    def _get_period(self, n_sec, n_nsec, p_sec, p_nsec):
-        to_sec = lambda sec, nsec: sec + nsec / (10 ** 9)
-        return to_sec(n_sec, n_nsec) - to_sec(p_sec, p_nsec) # to seconds
+    def _publish_snapshot(self):
+        """
+            Publish the port stats of this cycle.
+        """
+        snapshots.publish('port_stat', self.get_port_stats())
+        snapshots.publish('delta_port_stat', self.get_delta_port_stats())
 
     # Bandwidth graph:
-    def _save_freebandwidth(self, dpid, port_no, speed):
-        # Calculate free bandwidth of port and save it.
-        port_state = self.port_features.get(dpid).get(port_no)
-        if port_state:
-            capacity = port_state[2] / (10**3)  # Kbp/s to MBit/s
-            speed = float(speed * 8) / (10**6) # byte/s to Mbit/s
-            curr_bw = max(capacity - speed, 0)
-            self.free_bandwidth[dpid].setdefault(port_no, None)
-            self.free_bandwidth[dpid][port_no] = (curr_bw, speed) # Save as Mbit/s
-        else:
+    def _save_freebandwidth_batch(self, dpid, port_nos, speed, valid):
+        """
+            Calculate free bandwidth of every port in a reply and save it.
+            speed: byte/s array aligned with port_nos, valid: mask of usable speeds
+            Returns the utilization (usage / capacity) of every port, nan if unknown.
+        """
+        features = self.port_features.get(dpid, {})
+        capacity = np.array([features[port_no][2] if port_no in features else np.nan
+                             for port_no in port_nos], dtype=np.float64) / (10**3)  # Kbp/s to MBit/s
+        speed = speed * 8 / (10**6) # byte/s to Mbit/s
+        curr_bw = np.maximum(capacity - speed, 0)
+
+        known = ~np.isnan(capacity)
+        if not known[valid].all():
             self.logger.warning("Fail in getting port state")
-            
+
+        save = valid & known
+        free_bandwidth = self.free_bandwidth[dpid]
+        for port_no, bw, usage in zip(np.asarray(port_nos)[save].tolist(),
+                                      curr_bw[save].tolist(),
+                                      speed[save].tolist()):
+            free_bandwidth[port_no] = (bw, usage) # Save as Mbit/s
+        return np.divide(speed, capacity, out=np.full(len(port_nos), np.nan),
+                         where=valid & known & (capacity > 0))
+
     def _create_bandwidth_graph(self, free_bandwidth):
         """
-            Save bandwidth data into networkx graph object.
+            Save bandwidth data of every link into the link metrics.
         """
         try:
-            graph = self.topology_data.graph
+            link_metrics = self.topology_data.link_metrics
             link_to_port = self.topology_data.link_to_port
-            for link in link_to_port:
-                (src_dpid, dst_dpid) = link
-                (src_port, dst_port) = link_to_port[link]
-                if src_dpid in free_bandwidth and dst_dpid in free_bandwidth:
-                    src_free_bandwidth, src_link_usage = free_bandwidth[src_dpid][src_port]
-                    dst_free_bandwidth, dst_link_usage = free_bandwidth[dst_dpid][dst_port]
-                    
-                    # Get the min bandwidth / speed between scr_dpid(and src_port) compare to
-                    # dst_dpid(and dst_port) 
-                    bandwidth = min(src_free_bandwidth, dst_free_bandwidth)
-                    link_usage = min(src_link_usage, dst_link_usage)
-                
-                    # add key:value of bandwidth into graph.
-                    graph[src_dpid][dst_dpid]['free_bandwidth'] = bandwidth
-                    
-                    # !NOTE: aka current speed of the link
-                    graph[src_dpid][dst_dpid]['link_usage'] = link_usage 
-                    # graph[src_dpid][dst_dpid]['link_utilization'] = None
-                else:
-                    graph[src_dpid][dst_dpid]['bandwidth'] = 0
-                    graph[src_dpid][dst_dpid]['link_usage'] = 0
-            return graph
+            rows, links = link_metrics.live()
+            src_bw = np.array([free_bandwidth.get(src_dpid, {}).get(link_to_port[(src_dpid, dst_dpid)][0], (np.nan, np.nan))
+                               for src_dpid, dst_dpid in links], dtype=np.float64).reshape(-1, 2)
+            dst_bw = np.array([free_bandwidth.get(dst_dpid, {}).get(link_to_port[(src_dpid, dst_dpid)][1], (np.nan, np.nan))
+                               for src_dpid, dst_dpid in links], dtype=np.float64).reshape(-1, 2)
+            known = ~np.isnan(src_bw[:, 0]) & ~np.isnan(dst_bw[:, 0])
+
+            # Get the min bandwidth / speed between scr_dpid(and src_port) compare to
+            # dst_dpid(and dst_port) 
+            bandwidth = np.minimum(src_bw, dst_bw)
+            link_metrics.set('free_bandwidth', rows[known], bandwidth[known, 0])
+            # !NOTE: aka current speed of the link, nan (null) while unknown, 0 when idle
+            link_metrics.set('link_usage', rows[known], bandwidth[known, 1])
         except:
             self.logger.info("Create bw graph exception")
             if self.topology_data is None:
                 self.topology_data = lookup_service_brick(TOPOLOGY_DATA)
-            return self.topology_data.graph
 
-    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    # Packet loss graph:
+    def _save_port_loss(self):
+        """
+            Save the packet loss of every link in 'port' loss mode into the link metrics.
+        """
+        try:
+            link_metrics = self.topology_data.link_metrics
+            link_to_port = self.topology_data.link_to_port
+            links = [link for link in link_to_port
+                     if LINK_LOSS_MODES.get(link, LINK_LOSS_MODE) == 'port']
+            if not links:
+                return
+            # nan (null) while unknown, so a link whose src port stopped sending
+            # does not keep its last loss
+            link_metrics.set('packet_loss', link_metrics.lookup(links), self._port_link_loss(links, link_to_port))
+        except:
+            self.logger.info("Create port loss exception")
+            if self.topology_data is None:
+                self.topology_data = lookup_service_brick(TOPOLOGY_DATA)
+
+    def _port_link_loss(self, links, link_to_port):
+        """
+            Loss of every link at once from the latest port deltas:
+            1 - rx packet rate of the dst port / tx packet rate of the src port.
+            nan when a port has no delta yet or the src port sent nothing.
+        """
+        rows = self.delta_port_stats.rows
+        src_rows = np.array([rows.get((src_dpid, link_to_port[(src_dpid, dst_dpid)][0]), -1)
+                             for src_dpid, dst_dpid in links], dtype=np.int64)
+        dst_rows = np.array([rows.get((dst_dpid, link_to_port[(src_dpid, dst_dpid)][1]), -1)
+                             for src_dpid, dst_dpid in links], dtype=np.int64)
+        known = (src_rows >= 0) & (dst_rows >= 0)
+        src_rows[~known] = 0
+        dst_rows[~known] = 0
+        # the first delta of a port holds raw counters
+        count = self.delta_port_stats.count
+        known &= (count[src_rows] > 1) & (count[dst_rows] > 1)
+
+        src = self.delta_port_stats.take(src_rows)
+        dst = self.delta_port_stats.take(dst_rows)
+        src_period = src[:, 5] + src[:, 6] / (10 ** 9)
+        dst_period = dst[:, 5] + dst[:, 6] / (10 ** 9)
+        valid = known & (src_period > 0) & (dst_period > 0) & (src[:, 0] > 0)
+
+        tx_rate = np.divide(src[:, 0], src_period, out=np.zeros(len(links)), where=valid)
+        rx_rate = np.divide(dst[:, 1], dst_period, out=np.zeros(len(links)), where=valid)
+        packet_loss = np.divide(tx_rate - rx_rate, tx_rate, out=np.full(len(links), np.nan), where=valid)
+        # the two ends are polled at different times: clamp the skew
+        return np.clip(packet_loss, 0, 1)
+
     def _port_stats_reply_handler(self, ev):
         """
             Save port's stats info
             Calculate port's speed and save it.
 
-            port_stats: {(dpid port_no): [(tx_packets, rx_packets ,tx_bytes, rx_bytes, rx_errors, duration_sec, duration_nsec),...]}
+            port_stats: {(dpid port_no): ring of (tx_packets, rx_packets ,tx_bytes, rx_bytes, rx_errors, duration_sec, duration_nsec)}
             [history][stat_type]
             value is a tuple (tx_packets, rx_packets ,tx_bytes, rx_bytes, rx_errors, duration_sec, duration_nsec)
                                   0          1           2         3          4           5             6         
+
+            The whole reply is handled as column arrays: deltas, periods and
+            speeds of every port are computed at once. A switch with many ports
+            replies in several parts (OFPMPF_REPLY_MORE), each handled as it arrives.
         """
-        body = ev.msg.body
-        dpid = ev.msg.datapath.id
+        msg = ev.msg
+        body = msg.body
+        dpid = msg.datapath.id
     
         self.free_bandwidth.setdefault(dpid, {})
+        self.port_clock += 1
+        stamp = self.port_clock
+
+        stats = [stat for stat in body if stat.port_no != ofproto_v1_3.OFPP_LOCAL]
+        port_nos = [stat.port_no for stat in stats]
+
+        cycle = self.port_cycle.get(dpid)
+        if cycle is None or cycle[0] != msg.xid:
+            # first part of a reply
+            cycle = self.port_cycle[dpid] = [msg.xid, set()]
+        cycle[1].update(port_nos)
+        if not msg.flags & ofproto_v1_3.OFPMPF_REPLY_MORE:
+            # last part: ports missing from the whole reply are gone
+            del self.port_cycle[dpid]
+            self._evict_ports(dpid, self.port_nos.get(dpid, set()).difference(cycle[1]))
+            self.port_nos[dpid] = cycle[1]
+        if not stats:
+            return
+
+        keys = [(dpid, port_no) for port_no in port_nos]
+        values = np.array([(stat.tx_packets, stat.rx_packets, stat.tx_bytes, stat.rx_bytes,
+                            stat.rx_errors, stat.duration_sec, stat.duration_nsec)
+                           for stat in stats], dtype=np.uint64)
+
+        # Monitoring current port.
+        rows = self.port_stats.append_batch(keys, values, stamp)
+        first = self.port_stats.count[rows] == 1
+
+        # newest minus second newest; a port seen for the first time keeps
+        # its raw counters with STATS_REQUEST_INTERVAL as period
+        prev = self.port_stats.take(rows, 2)
+        prev[first] = 0
+        delta = counter_delta(values, prev)
+        delta[first, 6] = STATS_REQUEST_INTERVAL
+        self.delta_port_stats.append_batch(keys, delta, stamp)
+
+        # speed is delta stat over a perid bettween prev and curr stat (tx_bytes + rx_bytes)
+        period = delta[:, 5] + delta[:, 6] / (10 ** 9)
+        valid = ~first & (period > 0)
+        speed = np.divide(delta[:, 2] + delta[:, 3], period,
+                          out=np.full(len(stats), np.nan), where=valid)
+
+        # save free bandwidth (link capacity, can be used for load balancing, calculate link utilization) - Not work in mininet (reason: no link bandwidth)
+        utilization = self._save_freebandwidth_batch(dpid, port_nos, speed, valid)
+        self.collector.report_activity(PORT_STATS, dpid, self._port_activity(rows, speed, utilization))
+        self._enforce_port_cap()
+
+    def _port_activity(self, rows, speed, utilization):
+        """
+            Activity of a datapath for the stats collector, in [0, 1]:
+            the highest port utilization or relative change of speed since the previous poll.
+        """
+        prev = self.delta_port_stats.take(rows, 2)
+        prev_period = prev[:, 5] + prev[:, 6] / (10 ** 9)
+        # the oldest delta of a port holds raw counters
+        known = (self.port_stats.count[rows] > 2) & (prev_period > 0) & ~np.isnan(speed)
+        prev_speed = np.divide(prev[:, 2] + prev[:, 3], prev_period,
+                               out=np.zeros(len(rows)), where=known)
+        change = np.divide(np.abs(speed - prev_speed), np.maximum(speed, prev_speed),
+                           out=np.zeros(len(rows)), where=known & (np.maximum(speed, prev_speed) > 0))
+        activity = np.nanmax(np.concatenate((change, utilization, [0])))
+        return float(min(activity, 1))
+
+    def _evict_ports(self, dpid, port_nos):
+        for port_no in port_nos:
+            self.port_stats.remove((dpid, port_no))
+            self.delta_port_stats.remove((dpid, port_no))
+            self.free_bandwidth.get(dpid, {}).pop(port_no, None)
+            self.port_nos.get(dpid, set()).discard(port_no)
+
+    def _enforce_port_cap(self):
+        """
+            Evict the least recently updated ports once PORT_STATS_MAX_ENTRIES is exceeded.
+        """
+        if len(self.port_stats) <= PORT_STATS_MAX_ENTRIES:
+            return
+        excess = len(self.port_stats) - int(PORT_STATS_MAX_ENTRIES * 0.9)
+        for _, (dpid, port_no) in self.port_stats.oldest(excess):
+            self._evict_ports(dpid, (port_no, ))
+        self.logger.info('port stats over cap: evicted %d entries', excess)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        """
+            Drop everything known about a datapath that went away.
+        """
+        dpid = ev.datapath.id
+        if ev.state != DEAD_DISPATCHER or dpid is None:
+            return
+        self._evict_ports(dpid, list(self.port_nos.get(dpid, ())))
+        for store in (self.port_nos, self.port_cycle, self.free_bandwidth, self.port_features):
+            store.pop(dpid, None)
 
-        # !FIXME: add rx_packets
-        for stat in sorted(body, key=attrgetter('port_no')):
-            port_no = stat.port_no
-            if port_no != ofproto_v1_3.OFPP_LOCAL:
-
-                key = (dpid, port_no)
-                value = (stat.tx_packets, stat.rx_packets, stat.tx_bytes, stat.rx_bytes,
-                         stat.rx_errors, stat.duration_sec, stat.duration_nsec)
-
-                # Monitoring current port.
-                self._save_stats(self.port_stats, key, value, 5)
-
-                port_stats = self.port_stats[key]
-
-                if len(port_stats) == 1:
-                    self._save_stats(self.delta_port_stats, key, (stat.tx_packets, stat.rx_packets, stat.tx_bytes, stat.rx_bytes, stat.rx_errors, stat.duration_sec, STATS_REQUEST_INTERVAL), 5)
-                
-                if len(port_stats) > 1:
-                    # tx_bytes + rx_bytes (line : 36)
-                    # newest and second newst of stat
-                    curr_stat = port_stats[-1][2] + port_stats[-1][3]
-                    prev_stat = port_stats[-2][2] + port_stats[-2][3]
-
-                    period = self._get_period(port_stats[-1][5], port_stats[-1][6],
-                                              port_stats[-2][5], port_stats[-2][6])
-
-                    # speed is delta stat over a perid bettween prev and curr stat 
-                    speed = self._cal_delta_stat(curr_stat, prev_stat, period)
-                    
-                    # Using maping to save detal_port_stats.
-                    self._save_stats(self.delta_port_stats, key, tuple(map(operator.sub, port_stats[-1], port_stats[-2])), 5)
-
-                    # save free bandwidth (link capacity, can be used for load balancing, calculate link utilization) - Not work in mininet (reason: no link bandwidth)
-                    self._save_freebandwidth(dpid, port_no, speed)
-
-    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
     def _port_desc_stats_reply_handler(self, ev):
         """
             Save port description info.
@@ -201,6 +304,14 @@ class PortStatistic(app_manager.RyuApp):
         dpid = msg.datapath.id
         ofproto = msg.datapath.ofproto
 
+        port_features = self.port_features.setdefault(dpid, {})
+        for p in ev.msg.body:
+            port_features[p.port_no] = self._port_feature(ofproto, p)
+
+    def _port_feature(self, ofproto, p):
+        """
+            (config, state, curr_speed) of an OFPPort.
+        """
         config_dict = {ofproto.OFPPC_PORT_DOWN: "Down",
                        ofproto.OFPPC_NO_RECV: "No Recv",
                        ofproto.OFPPC_NO_FWD: "No Farward",
@@ -210,30 +321,17 @@ class PortStatistic(app_manager.RyuApp):
                       ofproto.OFPPS_BLOCKED: "Blocked",
                       ofproto.OFPPS_LIVE: "Live"}
 
-        ports = []
-        for p in ev.msg.body:
-            ports.append('port_no=%d hw_addr=%s name=%s config=0x%08x '
-                         'state=0x%08x curr=0x%08x advertised=0x%08x '
-                         'supported=0x%08x peer=0x%08x curr_speed=%d '
-                         'max_speed=%d' %
-                         (p.port_no, p.hw_addr,
-                          p.name, p.config,
-                          p.state, p.curr, p.advertised,
-                          p.supported, p.peer, p.curr_speed,
-                          p.max_speed))
-
-            if p.config in config_dict:
-                config = config_dict[p.config]
-            else:
-                config = "up"
-
-            if p.state in state_dict:
-                state = state_dict[p.state]
-            else:
-                state = "up"
-
-            port_feature = (config, state, p.curr_speed)
-            self.port_features[dpid][p.port_no] = port_feature
+        if p.config in config_dict:
+            config = config_dict[p.config]
+        else:
+            config = "up"
+
+        if p.state in state_dict:
+            state = state_dict[p.state]
+        else:
+            state = "up"
+
+        return (config, state, p.curr_speed)
 
     @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
     def _port_status_handler(self, ev):
@@ -252,6 +350,13 @@ class PortStatistic(app_manager.RyuApp):
             ofproto.OFPPR_MODIFY: "modified",
         }
 
+        if reason == ofproto.OFPPR_DELETE:
+            self._evict_ports(dpid, (port_no, ))
+            # features only come back with port status or the description reconcile
+            self.port_features.get(dpid, {}).pop(port_no, None)
+        elif reason in (ofproto.OFPPR_ADD, ofproto.OFPPR_MODIFY):
+            self.port_features.setdefault(dpid, {})[port_no] = self._port_feature(ofproto, msg.desc)
+
         if reason in reason_dict:
             print("switch%d: port %s %s" %
                   (dpid, reason_dict[reason], port_no))
@@ -267,7 +372,7 @@ class PortStatistic(app_manager.RyuApp):
         stats = []
         port_stats = self.port_stats
         for dpid, port_no in port_stats:
-            tx_packtes, rx_packets, tx_bytes, rx_bytes, rx_errors, duration_sec, duration_nsec = port_stats[(dpid, port_no)][-1]
+            tx_packtes, rx_packets, tx_bytes, rx_bytes, rx_errors, duration_sec, duration_nsec = port_stats.last((dpid, port_no))
             stats.append({
                 'dpid': dpid,
                 'port_no': port_no,
@@ -286,7 +391,7 @@ class PortStatistic(app_manager.RyuApp):
         stats = []
         delta_port_stats = self.delta_port_stats
         for dpid, port_no in delta_port_stats:
-            tx_packtes, rx_packets, tx_bytes, rx_bytes, rx_errors, duration_sec, duration_nsec = delta_port_stats[(dpid, port_no)][-1]
+            tx_packtes, rx_packets, tx_bytes, rx_bytes, rx_errors, duration_sec, duration_nsec = delta_port_stats.last((dpid, port_no))
             stats.append({
                 'dpid': dpid,
                 'port_no': port_no,
@@ -306,5 +411,5 @@ class PortStatistic(app_manager.RyuApp):
             pass
 
 # sudo mn --topo linear,4 --controller=remote,ip=localhost,port=6633 --switch ovsk --link tc,bw=0.1,delay=0ms,loss=10
-# ryu-manager --observe-link --ofp-tcp-listen-port=6633 topology_data.py port_statistic.py
+# ryu-manager --observe-link --ofp-tcp-listen-port=6633 topology_data.py stats_collector.py port_statistic.py
 # http://www.muzixing.com/tag/ryu-bandwidth.html
\ No newline at end of file
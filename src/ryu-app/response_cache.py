@@ -0,0 +1,89 @@
+# Encoded REST response bodies, cached per snapshot version
+import gzip
+import hashlib
+import json
+
+
+class CachedBody(object):
+    """
+        Body of an endpoint for one snapshot version: json encoded once,
+        gzip compressed on the first request accepting it.
+        etag is derived from the content, so it holds across restarts and
+        republished snapshots with unchanged data; gzip_etag tags the
+        compressed representation, which has different bytes.
+    """
+
+    __slots__ = ('version', 'body', 'etag', 'gzip_etag', '_gzip_body')
+
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+        digest = hashlib.md5(body, usedforsecurity=False).hexdigest()
+        self.etag = '"%s"' % digest
+        self.gzip_etag = '"%s-gzip"' % digest
+        self._gzip_body = None
+
+    def gzip_body(self):
+        if self._gzip_body is None:
+            self._gzip_body = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._gzip_body
+
+
+class ResponseCache(object):
+    """
+        Latest encoded body of every endpoint, rebuilt only when the
+        snapshot it is encoded from has a new version.
+    """
+
+    def __init__(self):
+        self.entries = {} # {endpoint: CachedBody}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, endpoint, snapshot, encode=None):
+        """
+            Cached body of endpoint for snapshot.
+            encode(data): body of the snapshot data as str, json.dumps by default.
+        """
+        entry = self.entries.get(endpoint)
+        if entry is not None and entry.version == snapshot.version:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        body = (json.dumps if encode is None else encode)(snapshot.data)
+        entry = self.entries[endpoint] = CachedBody(snapshot.version, body.encode('utf-8'))
+        return entry
+
+
+def etag_matches(if_none_match, etag):
+    """
+        True if the If-None-Match header value lists etag (weak compare) or is *.
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding):
+    """
+        True if the Accept-Encoding header value allows gzip.
+    """
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            q = params.strip()
+            if not q.startswith('q='):
+                return True
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+    return False
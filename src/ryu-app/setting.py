@@ -5,14 +5,67 @@ TOPOLOGY_DATA = 'topology_data'
 FLOW_MANAGER = 'flow_manager'
 PORT_STATISTIC = 'port_statistic'
 FLOW_STATISTIC = 'flow_statistic'
+STATS_COLLECTOR = 'stats_collector'
+LOSS_PROBER = 'loss_prober'
 
 
 SHOW_DEBUG = True
 
 STATS_REQUEST_INTERVAL = 3
+# Adaptive polling: busy datapaths are polled every STATS_MIN_INTERVAL, idle ones
+# every STATS_MAX_INTERVAL, all pollers together send at most STATS_MAX_REQUESTS_PER_SEC
+# (echo requests for the link delay are not counted)
+STATS_MIN_INTERVAL = 1
+STATS_MAX_INTERVAL = 10
+STATS_MAX_REQUESTS_PER_SEC = 200
+# A stats request unanswered after this many seconds is given up
+STATS_REQUEST_TIMEOUT = 5
+# Port features follow port status messages, the port description is polled
+# this often (s) only to reconcile missed ones
+PORT_DESC_RECONCILE_INTERVAL = 60
 DISCOVER_INTERVAL = 3
+# Topology event coalescing (seconds): flush once no event arrived for
+# TOPOLOGY_DEBOUNCE_WINDOW, or TOPOLOGY_MAX_LATENCY after the first pending one
+TOPOLOGY_DEBOUNCE_WINDOW = 0.1
+TOPOLOGY_MAX_LATENCY = 1
 PROBE_PACKETLOSS_INTERVAL = 3
+# Link loss from 'port': tx counter of the upstream port against rx counter of the
+# downstream port, every link in one pass, 'flow': paired flow stats of both ends, or
+# 'aggregate': aggregate stats of the upstream egress port and the downstream ingress port,
+# or 'probe': probe trains sent through the link by loss_prober.py
+LINK_LOSS_MODE = 'port'
+LINK_LOSS_MODES = {} # {(src_dpid, dst_dpid): mode} - per link override of LINK_LOSS_MODE
+
+# Active loss probing of the links in 'probe' loss mode: a train of LOSS_PROBE_TRAIN
+# probe frames per link every LOSS_PROBE_INTERVAL (s), all links together send at most
+# LOSS_PROBE_MAX_PPS probes per second (None: no limit), a probe not back within
+# LOSS_PROBE_TIMEOUT (s) after the last one of its train is lost
+LOSS_PROBE_INTERVAL = 10
+LOSS_PROBE_TRAIN = 50
+LOSS_PROBE_MAX_PPS = 1000
+LOSS_PROBE_TIMEOUT = 1
 
 GRAPH_UPDATE_INTERVAL = 3
 
-DELAY_DETECTING_INTERVAL = 3
\ No newline at end of file
+DELAY_DETECTING_INTERVAL = 3
+ECHO_RTT_WINDOW = 5
+# Link delay statistics: over the last DELAY_STATS_WINDOW samples, EWMA smoothing factor
+DELAY_STATS_WINDOW = 100
+DELAY_EWMA_ALPHA = 0.2
+
+# Memory cap of the statistic stores (entries), least recently updated are evicted first
+FLOW_STATS_MAX_ENTRIES = 100000
+PORT_STATS_MAX_ENTRIES = 50000
+
+# Flow stats request filters, so switches only return the flows used for link loss
+FLOW_STATS_TABLE_ID = None      # None: every table
+FLOW_STATS_OUT_PORT = None      # None: any output port
+FLOW_STATS_COOKIE = 0
+FLOW_STATS_COOKIE_MASK = 0      # 0: any cookie
+FLOW_STATS_MATCH = {}           # OFPMatch fields, e.g. {'eth_type': 0x0800}
+# Priority can't be filtered on in a request: other flows are dropped on reply
+FLOW_STATS_PRIORITY = 1
+
+# Metric update stream (/stream websocket): messages queued per client before it
+# is dropped as too slow
+STREAM_QUEUE_SIZE = 64
@@ -0,0 +1,66 @@
+# Versioned snapshots of the monitoring data for the REST API
+import logging
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class Snapshot(object):
+    """
+        Data of one REST resource as of the end of an update cycle.
+        data is built for the snapshot and never changed afterwards: readers
+        use it as is, without locking or copying.
+    """
+
+    __slots__ = ('name', 'version', 'timestamp', 'data')
+
+    def __init__(self, name, version, timestamp, data):
+        self.name = name
+        self.version = version
+        self.timestamp = timestamp
+        self.data = data
+
+
+class SnapshotStore(object):
+    """
+        Latest snapshot of every resource. Publishing replaces the reference
+        in one assignment, so a reader always gets a whole snapshot, old or
+        new, never a mix. Versions increase across all resources.
+
+        Listeners are called with (previous snapshot or None, snapshot) on
+        every publish, in the publishing thread: they must not block. A
+        failing listener is logged and does not stop the publish.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.snapshots = {} # {name: Snapshot}
+        self.listeners = [] # [callback(previous, snapshot),...]
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    def publish(self, name, data, now=None):
+        self.version += 1
+        snapshot = Snapshot(name, self.version, time.time() if now is None else now, data)
+        previous = self.snapshots.get(name)
+        self.snapshots[name] = snapshot
+        for callback in list(self.listeners):
+            try:
+                callback(previous, snapshot)
+            except Exception:
+                LOG.exception('snapshot listener failed: %s', name)
+        return snapshot
+
+    def get(self, name):
+        """
+            Latest snapshot of name, None if none was published yet.
+        """
+        return self.snapshots.get(name)
+
+
+# One store for every app in the controller
+snapshots = SnapshotStore()
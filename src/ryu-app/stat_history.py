@@ -0,0 +1,178 @@
+# Compact counter history for the statistic apps
+import numpy as np
+
+# OpenFlow reports a counter the switch does not support as all ones
+UNSUPPORTED = np.iinfo(np.uint64).max
+
+
+def counter_delta(new, old):
+    """
+        new - old of uint64 counter arrays as int64.
+        The subtraction wraps, so a counter that wrapped around still gives its
+        increase, and a counter that went back (reset, nsec rollover) a negative delta.
+        Counters unsupported (all ones) in either sample give 0.
+    """
+    new = np.asarray(new, dtype=np.uint64)
+    old = np.asarray(old, dtype=np.uint64)
+    delta = (new - old).view(np.int64)
+    delta[(new == UNSUPPORTED) | (old == UNSUPPORTED)] = 0
+    return delta
+
+
+class StatHistory(object):
+    """
+        Fixed-capacity ring buffers backed by one typed array:
+        one row per key ((dpid, port_no) or flow key), one column per counter.
+
+        data: [row][slot][column], head: next slot to write, count: samples stored.
+        Appending writes into the preallocated slot, nothing is allocated per sample.
+        stamp: caller's clock at the last append of the row, for expiry and LRU eviction.
+        Counters are unsigned 64 bit, as OpenFlow sends them; pass dtype=np.int64
+        for signed values such as deltas.
+    """
+
+    def __init__(self, columns, capacity=5, dtype=np.uint64, rows=16):
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self.data = np.zeros((rows, capacity, len(self.columns)), dtype=dtype)
+        self.head = np.zeros(rows, dtype=np.int64)
+        self.count = np.zeros(rows, dtype=np.int64)
+        self.stamp = np.zeros(rows, dtype=np.int64)
+        self.rows = {}                                # {key: row}
+        self.row_keys = [None] * rows                 # [row]: key
+        self.free_rows = list(range(rows - 1, -1, -1))  # unused rows, popped from the end
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(list(self.rows))
+
+    def keys(self):
+        return list(self.rows)
+
+    def _grow(self):
+        """
+            Double the number of rows, keeping the stored samples.
+        """
+        rows = len(self.head)
+        self.data = np.concatenate((self.data, np.zeros_like(self.data)))
+        self.head = np.concatenate((self.head, np.zeros(rows, dtype=np.int64)))
+        self.count = np.concatenate((self.count, np.zeros(rows, dtype=np.int64)))
+        self.stamp = np.concatenate((self.stamp, np.zeros(rows, dtype=np.int64)))
+        self.row_keys.extend([None] * rows)
+        self.free_rows.extend(range(2 * rows - 1, rows - 1, -1))
+
+    def row(self, key):
+        """
+            Row of key, allocated on first use.
+        """
+        row = self.rows.get(key)
+        if row is None:
+            if not self.free_rows:
+                self._grow()
+            row = self.free_rows.pop()
+            self.head[row] = 0
+            self.count[row] = 0
+            self.rows[key] = row
+            self.row_keys[row] = key
+        return row
+
+    def append(self, key, value, stamp=0):
+        row = self.row(key)
+        head = self.head[row]
+        self.data[row, head] = value
+        self.head[row] = (head + 1) % self.capacity
+        if self.count[row] < self.capacity:
+            self.count[row] += 1
+        self.stamp[row] = stamp
+        return row
+
+    def append_batch(self, keys, values, stamp=0):
+        """
+            Append one sample per key: values is a [len(keys)][column] array.
+            Returns the rows of keys, to be used with take().
+        """
+        rows = np.fromiter((self.row(key) for key in keys), dtype=np.int64, count=len(keys))
+        self.stamp[rows] = stamp
+        if len(np.unique(rows)) != len(rows):
+            # same key twice in one batch: keep the order of the samples
+            for row, value in zip(rows, values):
+                head = self.head[row]
+                self.data[row, head] = value
+                self.head[row] = (head + 1) % self.capacity
+                self.count[row] = min(self.count[row] + 1, self.capacity)
+            return rows
+
+        heads = self.head[rows]
+        self.data[rows, heads] = values
+        self.head[rows] = (heads + 1) % self.capacity
+        self.count[rows] = np.minimum(self.count[rows] + 1, self.capacity)
+        return rows
+
+    def take(self, rows, back=1):
+        """
+            Sample of each row as a [len(rows)][column] array: back=1 is the newest.
+        """
+        return self.data[rows, (self.head[rows] - back) % self.capacity]
+
+    def remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is not None:
+            self.count[row] = 0
+            self.row_keys[row] = None
+            self.free_rows.append(row)
+
+    def stale(self, stamp):
+        """
+            Keys not appended to since stamp.
+        """
+        rows = np.nonzero((self.count > 0) & (self.stamp < stamp))[0]
+        return [self.row_keys[row] for row in rows.tolist()]
+
+    def oldest(self, n):
+        """
+            Up to n (stamp, key) pairs of the least recently appended keys.
+        """
+        rows = np.nonzero(self.count > 0)[0]
+        if n < len(rows):
+            rows = rows[np.argpartition(self.stamp[rows], n)[:n]]
+        return [(int(self.stamp[row]), self.row_keys[row]) for row in rows.tolist()]
+
+    def clear(self):
+        self.rows.clear()
+        self.row_keys = [None] * len(self.head)
+        self.free_rows = list(range(len(self.head) - 1, -1, -1))
+        self.count[:] = 0
+
+    def samples(self, key):
+        """
+            Number of samples stored for key.
+        """
+        row = self.rows.get(key)
+        if row is None:
+            return 0
+        return int(self.count[row])
+
+    def latest(self, key, n=None):
+        """
+            Latest n samples of key, oldest first, as a [n][column] array.
+        """
+        row = self.rows[key]
+        count = int(self.count[row])
+        n = count if n is None else min(n, count)
+        slots = (self.head[row] - n + np.arange(n)) % self.capacity
+        return self.data[row, slots]
+
+    def last(self, key, back=1):
+        """
+            Sample of key as a tuple: back=1 is the newest, back=2 the one before.
+        """
+        row = self.rows[key]
+        return tuple(self.data[row, (self.head[row] - back) % self.capacity].tolist())
+
+    def nbytes(self):
+        return self.data.nbytes + self.head.nbytes + self.count.nbytes
@@ -0,0 +1,284 @@
+# Base
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import set_ev_cls, MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.ofproto import ofproto_v1_3
+
+# Thread
+from ryu.lib import hub
+
+import struct
+import time
+
+from setting import STATS_COLLECTOR, STATS_MIN_INTERVAL, FLOW_STATS_TABLE_ID, FLOW_STATS_OUT_PORT, \
+    FLOW_STATS_COOKIE, FLOW_STATS_COOKIE_MASK, FLOW_STATS_MATCH
+from stats_scheduler import PollScheduler, RequestTracker
+
+# Stat types
+PORT_STATS = 'port'
+PORT_DESC = 'port_desc'
+FLOW_STATS = 'flow'
+AGGREGATE = 'aggregate'
+ECHO = 'echo'
+
+
+class Subscription(object):
+    """
+        Callback of a subscriber for the replies of one stat type.
+        interval: longest poll interval the subscriber accepts (s)
+        dpid: only replies of this datapath, every datapath if None
+    """
+
+    def __init__(self, stat_type, callback, interval, dpid=None):
+        self.stat_type = stat_type
+        self.callback = callback
+        self.interval = interval
+        self.dpid = dpid
+
+    def covers(self, dpid):
+        return self.dpid is None or self.dpid == dpid
+
+
+class StatsCollector(app_manager.RyuApp):
+    """
+        Owns the polling of every datapath for the monitoring apps.
+
+        Subscribers register a callback per stat type with subscribe().
+        One request per stat type and datapath is in flight at a time, sent at
+        the shortest interval of the subscriptions covering the datapath, and
+        its reply event is handed to each of them. Port and flow stats are
+        polled adaptively (stats_scheduler.PollScheduler), the port
+        description, aggregate stats and echo at their fixed interval. Stats
+        requests share the STATS_MAX_REQUESTS_PER_SEC budget. Echo is sent
+        first and outside of it, so link delay never starves behind polling.
+
+        Aggregate stats are requested per target of a datapath, set with
+        set_aggregate_targets(): ('out_port', port_no) or ('in_port', port_no).
+        Their subscribers are called with callback(ev, target).
+    """
+
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    # Echo payload: monotonic send time (ns), sequence id
+    ECHO_PAYLOAD_STR = '!QI'
+    ECHO_PAYLOAD_SIZE = struct.calcsize(ECHO_PAYLOAD_STR)
+
+    def __init__(self, *args, **kwargs):
+        super(StatsCollector, self).__init__(*args, **kwargs)
+        self.name = STATS_COLLECTOR
+
+        self.datapaths = {} # {dpid: datapath}
+        self.subscriptions = {stat_type: [] for stat_type in (PORT_STATS, PORT_DESC, FLOW_STATS, AGGREGATE, ECHO)} # {stat_type: [Subscription,...]}
+        self.schedulers = {
+            # one small request per datapath and interval, due before the stats ones
+            ECHO: PollScheduler(budget=None, adaptive=False),
+            PORT_STATS: PollScheduler(),
+            FLOW_STATS: PollScheduler(),
+            # fetched as soon as a datapath connects
+            PORT_DESC: PollScheduler(adaptive=False, stagger=False),
+            # one request per target
+            AGGREGATE: PollScheduler(adaptive=False, cost=lambda dpid: len(self.aggregate_targets.get(dpid, ()))),
+        }
+        self.trackers = {stat_type: RequestTracker() for stat_type in self.schedulers}
+        self.aggregate_targets = {} # {dpid: {target,...}}
+        self.aggregate_xids = {} # {dpid: {xid: target}} - aggregate requests of the latest poll
+        self.echo_seq = 0
+        self.sync_needed = False # datapaths or subscriptions changed since the last sync
+
+        self.collect_thread = hub.spawn(self._collect_thread)
+
+    # Subscriber API:
+    def subscribe(self, stat_type, callback, interval, dpid=None):
+        """
+            Call callback(ev) with every reply of stat_type,
+            polling at least every interval seconds.
+        """
+        subscription = Subscription(stat_type, callback, interval, dpid)
+        self.subscriptions[stat_type].append(subscription)
+        self.sync_needed = True
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions[subscription.stat_type].remove(subscription)
+        self.sync_needed = True
+
+    def set_aggregate_targets(self, dpid, targets):
+        """
+            Aggregate stats to request from dpid: {('out_port', port_no) or ('in_port', port_no),...}
+        """
+        targets = set(targets)
+        if targets != self.aggregate_targets.get(dpid, set()):
+            if targets:
+                self.aggregate_targets[dpid] = targets
+            else:
+                self.aggregate_targets.pop(dpid, None)
+            self.sync_needed = True
+
+    def report_activity(self, stat_type, dpid, activity):
+        """
+            Activity of a datapath in [0, 1], adapts its poll interval.
+        """
+        self.schedulers[stat_type].report_activity(dpid, activity)
+
+    # Thread:
+    def _collect_thread(self):
+        while True:
+            now = time.time()
+            wait = STATS_MIN_INTERVAL
+            try:
+                if self.sync_needed:
+                    self._sync(now)
+                for stat_type, scheduler in self.schedulers.items():
+                    for dpid in scheduler.due(now, self.trackers[stat_type].busy):
+                        self._request_stats(stat_type, self.datapaths[dpid])
+                    wait = min(wait, scheduler.next_wakeup(now))
+            except:
+                self.logger.exception('stats collection failed')
+            hub.sleep(wait)
+
+    def _sync(self, now):
+        """
+            Poll interval of every datapath and stat type from the subscriptions.
+        """
+        self.sync_needed = False
+        for stat_type, scheduler in self.schedulers.items():
+            intervals = {} # {dpid: shortest subscribed interval}
+            for subscription in self.subscriptions[stat_type]:
+                dpids = self.datapaths if subscription.dpid is None else (subscription.dpid, )
+                for dpid in dpids:
+                    if stat_type == AGGREGATE and dpid not in self.aggregate_targets:
+                        continue
+                    if dpid in self.datapaths:
+                        intervals[dpid] = min(intervals.get(dpid, subscription.interval),
+                                              subscription.interval)
+            scheduler.sync(intervals, now)
+
+    # Stat request:
+    def _request_stats(self, stat_type, datapath):
+        self.logger.debug('send %s request: %016x', stat_type, datapath.id)
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        if stat_type == PORT_STATS:
+            req = parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY)
+        elif stat_type == PORT_DESC:
+            req = parser.OFPPortDescStatsRequest(datapath, 0)
+        elif stat_type == FLOW_STATS:
+            req = self._flow_stats_request(datapath)
+        elif stat_type == AGGREGATE:
+            self._request_aggregate_stats(datapath)
+            return
+        else:
+            self.echo_seq = (self.echo_seq + 1) & 0xffffffff
+            data = struct.pack(self.ECHO_PAYLOAD_STR, time.monotonic_ns(), self.echo_seq)
+            req = parser.OFPEchoRequest(datapath, data=data)
+
+        datapath.send_msg(req)
+        self.trackers[stat_type].sent(datapath.id, req.xid, time.time())
+
+    def _flow_stats_request(self, datapath):
+        """
+            Flow stats request narrowed by the FLOW_STATS_* filters.
+        """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        table_id = ofproto.OFPTT_ALL if FLOW_STATS_TABLE_ID is None else FLOW_STATS_TABLE_ID
+        out_port = ofproto.OFPP_ANY if FLOW_STATS_OUT_PORT is None else FLOW_STATS_OUT_PORT
+        return parser.OFPFlowStatsRequest(datapath, 0, table_id, out_port, ofproto.OFPG_ANY,
+                                          FLOW_STATS_COOKIE, FLOW_STATS_COOKIE_MASK,
+                                          parser.OFPMatch(**FLOW_STATS_MATCH))
+
+    def _request_aggregate_stats(self, datapath):
+        """
+            One aggregate stats request per target of the datapath,
+            narrowed by the same cookie and match filters as flow stats.
+        """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        table_id = ofproto.OFPTT_ALL if FLOW_STATS_TABLE_ID is None else FLOW_STATS_TABLE_ID
+        xids = self.aggregate_xids[datapath.id] = {}
+        for target in self.aggregate_targets.get(datapath.id, ()):
+            field, port_no = target
+            if field == 'out_port':
+                out_port, match = port_no, parser.OFPMatch(**FLOW_STATS_MATCH)
+            else:
+                out_port, match = ofproto.OFPP_ANY, parser.OFPMatch(in_port=port_no, **FLOW_STATS_MATCH)
+            req = parser.OFPAggregateStatsRequest(datapath, 0, table_id, out_port, ofproto.OFPG_ANY,
+                                                  FLOW_STATS_COOKIE, FLOW_STATS_COOKIE_MASK, match)
+            datapath.send_msg(req)
+            self.trackers[AGGREGATE].sent(datapath.id, req.xid, time.time())
+            xids[req.xid] = target
+
+    # Reply fan-out:
+    def _dispatch(self, stat_type, ev):
+        """
+            Hand a reply to the subscribers of stat_type.
+            Only replies to our own requests are samples: a late one, or
+            one requested by another app (e.g. ofctl_rest, maybe filtered), is not.
+        """
+        msg = ev.msg
+        dpid = msg.datapath.id
+        tracker = self.trackers[stat_type]
+        if not tracker.owns(dpid, msg.xid):
+            tracker.replied(dpid, msg.xid, time.time())
+            return
+
+        more = getattr(msg, 'flags', 0) & ofproto_v1_3.OFPMPF_REPLY_MORE
+        tracker.replied(dpid, msg.xid, time.time(), more)
+        if stat_type == AGGREGATE:
+            target = self.aggregate_xids.get(dpid, {}).pop(msg.xid, None)
+            for subscription in self.subscriptions[stat_type]:
+                if subscription.covers(dpid):
+                    subscription.callback(ev, target)
+            return
+        for subscription in self.subscriptions[stat_type]:
+            if subscription.covers(dpid):
+                subscription.callback(ev)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        self._dispatch(PORT_STATS, ev)
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
+    def _port_desc_stats_reply_handler(self, ev):
+        self._dispatch(PORT_DESC, ev)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        self._dispatch(FLOW_STATS, ev)
+
+    @set_ev_cls(ofp_event.EventOFPAggregateStatsReply, MAIN_DISPATCHER)
+    def _aggregate_stats_reply_handler(self, ev):
+        self._dispatch(AGGREGATE, ev)
+
+    @set_ev_cls(ofp_event.EventOFPEchoReply, MAIN_DISPATCHER)
+    def _echo_reply_handler(self, ev):
+        self._dispatch(ECHO, ev)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        datapath = ev.datapath
+        if datapath.id is None:
+            return
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(datapath.id, None)
+            self.aggregate_targets.pop(datapath.id, None)
+            self.aggregate_xids.pop(datapath.id, None)
+            for stat_type, scheduler in self.schedulers.items():
+                scheduler.remove(datapath.id)
+                self.trackers[stat_type].remove(datapath.id)
+        self.sync_needed = True
+
+    """
+        Accessor:
+        return info as dict
+    """
+    def get_poll_stats(self):
+        stats = {}
+        for stat_type, scheduler in self.schedulers.items():
+            stats[stat_type] = dict(scheduler.get_stats(), requests=self.trackers[stat_type].get_stats())
+        return stats
+
+# ryu-manager --observe-link --ofp-tcp-listen-port=6633 topology_data.py stats_collector.py port_statistic.py flow_statistic.py
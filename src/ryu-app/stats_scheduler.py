@@ -0,0 +1,271 @@
+# Stats polling schedule shared by the statistic apps
+import heapq
+import random
+import time
+from collections import deque
+
+from setting import STATS_REQUEST_INTERVAL, STATS_MIN_INTERVAL, STATS_MAX_INTERVAL, \
+    STATS_MAX_REQUESTS_PER_SEC, STATS_REQUEST_TIMEOUT
+
+
+class RequestBudget(object):
+    """
+        Token bucket limiting stats requests per second across all pollers.
+        burst: most requests sent at once after a pause, a second's worth by default.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.tokens = self.burst
+        self.last = time.time()
+
+    def take(self, cost=1):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+# One budget for every poller in the controller
+request_budget = RequestBudget(STATS_MAX_REQUESTS_PER_SEC)
+
+
+class PollScheduler(object):
+    """
+        Decide when each datapath is polled.
+
+        Datapaths start at a random offset inside the interval so requests
+        are spread evenly instead of sent in one burst. Each datapath's
+        interval moves between STATS_MIN_INTERVAL (busy, changing counters)
+        and STATS_MAX_INTERVAL (idle) following its reported activity, and
+        never exceeds the interval it was synced with.
+
+        Adaptation is per datapath, not per port or flow: one request returns
+        every port (or flow) of a switch, so they all share its interval.
+        The two ends of a link are polled independently, so metrics combining
+        both (port and flow pair loss) compare counters over windows that are
+        offset by up to an interval; 'probe' loss mode does not have this skew.
+
+        adaptive=False: poll every datapath exactly at its synced interval.
+        stagger=False: poll new datapaths right away.
+        budget=None: not rate limited.
+        cost: requests sent per poll, or cost(dpid) when it depends on the datapath.
+    """
+
+    RATE_WINDOW = 10  # polls kept to compute the effective poll rate
+
+    def __init__(self, cost=1, budget=request_budget, adaptive=True, stagger=True):
+        self.cost = cost          # requests sent per poll, or cost(dpid)
+        self.budget = budget
+        self.adaptive = adaptive
+        self.stagger = stagger
+        self.next_poll = {}       # {dpid: time of next poll}
+        self.interval = {}        # {dpid: current poll interval}
+        self.max_interval = {}    # {dpid: longest allowed poll interval}
+        self.activity = {}        # {dpid: smoothed activity in [0, 1]}
+        self.poll_times = {}      # {dpid: deque of recent poll times}
+        self.throttled = 0        # polls postponed by the budget
+        self._heap = []           # [(time, dpid)], entries not matching next_poll are stale
+
+    def _cost(self, dpid):
+        cost = self.cost(dpid) if callable(self.cost) else self.cost
+        # a poll costing more than the bucket holds would never be sent
+        return cost if self.budget is None else min(cost, self.budget.burst)
+
+    def _schedule(self, dpid, when):
+        self.next_poll[dpid] = when
+        heapq.heappush(self._heap, (when, dpid))
+
+    def sync(self, intervals, now):
+        """
+            Follow the datapaths to poll.
+            intervals: {dpid: longest allowed poll interval}
+        """
+        for dpid, max_interval in intervals.items():
+            if dpid not in self.next_poll:
+                self.max_interval[dpid] = max_interval
+                self.interval[dpid] = min(STATS_REQUEST_INTERVAL, max_interval) if self.adaptive else max_interval
+                self.activity[dpid] = 0.5
+                self.poll_times[dpid] = deque(maxlen=self.RATE_WINDOW)
+                offset = random.uniform(0, self.interval[dpid]) if self.stagger else 0
+                self._schedule(dpid, now + offset)
+            elif max_interval != self.max_interval[dpid]:
+                self.max_interval[dpid] = max_interval
+                if self.adaptive:
+                    self._set_interval(dpid, min(self.interval[dpid], max_interval))
+                else:
+                    self._set_interval(dpid, max_interval)
+        for dpid in [dpid for dpid in self.next_poll if dpid not in intervals]:
+            self.remove(dpid)
+
+    def remove(self, dpid):
+        for store in (self.next_poll, self.interval, self.max_interval, self.activity, self.poll_times):
+            store.pop(dpid, None)
+
+    def _set_interval(self, dpid, interval):
+        # pull the next poll in when the interval got shorter
+        when = self.next_poll[dpid] - self.interval[dpid] + interval
+        self.interval[dpid] = interval
+        if when < self.next_poll[dpid]:
+            self._schedule(dpid, when)
+
+    def due(self, now, busy=None):
+        """
+            Datapaths to poll now, within the request budget.
+            busy(dpid, now): datapaths it returns True for are skipped this round.
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, dpid = self._heap[0]
+            if self.next_poll.get(dpid) != when:
+                heapq.heappop(self._heap)
+                continue
+            if busy is not None and busy(dpid, now):
+                heapq.heappop(self._heap)
+                self._schedule(dpid, now + self.interval[dpid])
+                continue
+            if self.budget is not None and not self.budget.take(self._cost(dpid)):
+                self.throttled += 1
+                break
+            heapq.heappop(self._heap)
+            self.poll_times[dpid].append(now)
+            self._schedule(dpid, now + self.interval[dpid])
+            due.append(dpid)
+        return due
+
+    def next_wakeup(self, now):
+        """
+            Seconds until the next poll is due.
+        """
+        while self._heap and self.next_poll.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return STATS_MIN_INTERVAL
+        wait = self._heap[0][0] - now
+        if wait <= 0:
+            # over budget: wait for a token
+            return 0 if self.budget is None else self._cost(self._heap[0][1]) / self.budget.rate
+        return min(wait, STATS_MIN_INTERVAL)
+
+    def report_activity(self, dpid, activity):
+        """
+            activity in [0, 1]: 0 idle, 1 busy or changing fast.
+        """
+        if dpid not in self.activity or not self.adaptive:
+            return
+        smoothed = 0.7 * self.activity[dpid] + 0.3 * min(max(activity, 0), 1)
+        self.activity[dpid] = smoothed
+        interval = STATS_MAX_INTERVAL - (STATS_MAX_INTERVAL - STATS_MIN_INTERVAL) * smoothed
+        self._set_interval(dpid, min(interval, self.max_interval[dpid]))
+
+    def poll_rates(self):
+        """
+            Effective polls per second of each datapath over its recent polls.
+        """
+        rates = {}
+        for dpid, times in self.poll_times.items():
+            if len(times) > 1 and times[-1] > times[0]:
+                rates[dpid] = (len(times) - 1) / (times[-1] - times[0])
+            else:
+                rates[dpid] = 1 / self.interval[dpid]
+        return rates
+
+    def get_stats(self):
+        return {
+            'poll_rate': self.poll_rates(),
+            'interval': dict(self.interval),
+            'activity': dict(self.activity),
+            'throttled': self.throttled,
+        }
+
+
+class RequestTracker(object):
+    """
+        In-flight stats requests per datapath, by xid.
+
+        A datapath with a request outstanding is busy and skipped by the
+        poller, so a lagging switch never has more than one round queued.
+        Requests unanswered after STATS_REQUEST_TIMEOUT are dropped, their
+        late replies are not used.
+    """
+
+    EXPIRED_WINDOW = 16  # timed out xids remembered per datapath
+
+    def __init__(self, timeout=STATS_REQUEST_TIMEOUT):
+        self.timeout = timeout
+        self.pending = {}   # {dpid: {xid: send time}}
+        self.expired = {}   # {dpid: deque of timed out xids}
+        self.counters = {}  # {dpid: {'sent', 'skipped', 'timeouts', 'late', 'latency'}}
+
+    def _counter(self, dpid):
+        counter = self.counters.get(dpid)
+        if counter is None:
+            counter = self.counters[dpid] = {'sent': 0, 'skipped': 0, 'timeouts': 0,
+                                             'late': 0, 'latency': None}
+        return counter
+
+    def sent(self, dpid, xid, now):
+        self.pending.setdefault(dpid, {})[xid] = now
+        self._counter(dpid)['sent'] += 1
+
+    def owns(self, dpid, xid):
+        """
+            True if xid is a request of dpid in flight.
+        """
+        return xid in self.pending.get(dpid, ())
+
+    def busy(self, dpid, now):
+        """
+            True if dpid still has a request in flight; expires timed out ones.
+        """
+        pending = self.pending.get(dpid)
+        if not pending:
+            return False
+        counter = self._counter(dpid)
+        for xid in [xid for xid, sent in pending.items() if now - sent > self.timeout]:
+            del pending[xid]
+            self.expired.setdefault(dpid, deque(maxlen=self.EXPIRED_WINDOW)).append(xid)
+            counter['timeouts'] += 1
+        if pending:
+            counter['skipped'] += 1
+            return True
+        return False
+
+    def replied(self, dpid, xid, now, more=False):
+        """
+            Account a reply part. Returns False for the late reply of a timed
+            out request; replies to requests of other apps are usable.
+            more: OFPMPF_REPLY_MORE set, the request stays in flight.
+        """
+        pending = self.pending.get(dpid, {})
+        sent = pending.get(xid)
+        if sent is None:
+            if xid in self.expired.get(dpid, ()):
+                self._counter(dpid)['late'] += 1
+                return False
+            return True
+        if not more:
+            del pending[xid]
+            counter = self._counter(dpid)
+            latency = now - sent
+            # smoothed reply latency (s)
+            if counter['latency'] is None:
+                counter['latency'] = latency
+            else:
+                counter['latency'] = 0.8 * counter['latency'] + 0.2 * latency
+        return True
+
+    def remove(self, dpid):
+        self.pending.pop(dpid, None)
+        self.expired.pop(dpid, None)
+        self.counters.pop(dpid, None)
+
+    def get_stats(self):
+        stats = {}
+        for dpid, counter in self.counters.items():
+            stats[dpid] = dict(counter, in_flight=len(self.pending.get(dpid, ())))
+        return stats
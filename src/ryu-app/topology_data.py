@@ -10,26 +10,51 @@ from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISP
 
 # Topology
 from ryu.controller.controller import Datapath
-from ryu.topology.api import get_link, get_switch, get_host, get_all_switch, get_all_host, get_all_link
+from ryu.topology.api import get_all_switch, get_all_host, get_all_link
 from ryu.topology.switches import Switch, Link, Host, Port
 
-from setting import TOPOLOGY_DATA, DISCOVER_INTERVAL
+from setting import TOPOLOGY_DATA, DISCOVER_INTERVAL, TOPOLOGY_DEBOUNCE_WINDOW, TOPOLOGY_MAX_LATENCY, \
+    GRAPH_UPDATE_INTERVAL
+from link_metrics import LinkMetricTable
+from snapshot import snapshots
 
 # Thread:
 from ryu.lib import hub
 
 # Graph:
 import networkx as nx
+import time
 
 class TopologyData(app_manager.RyuApp):
     
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    # Order in which a coalesced change set is applied: additions first,
+    # then removals, so a link never refers to a switch applied later.
+    _EVENT_PHASE = {
+        event.EventSwitchEnter: 0,
+        event.EventPortAdd: 1,
+        event.EventPortModify: 1,
+        event.EventLinkAdd: 2,
+        event.EventLinkDelete: 3,
+        event.EventPortDelete: 4,
+        event.EventSwitchLeave: 5,
+    }
     
     def __init__(self, *_args, **_kwargs):
         super(TopologyData, self).__init__(*_args, **_kwargs)
         self.name = TOPOLOGY_DATA
         self.topology_api_app = self
         
+        # Pending topology events, coalesced by _discover_thread
+        self.pending_events = {}     # {event key: latest event}
+        self.pending_count = 0       # events received since last flush
+        self.first_pending = None    # arrival time of the oldest pending event
+        self.last_pending = None     # arrival time of the newest pending event
+        self.pending_event = hub.Event()
+        self.coalesce_stats = {'flushes': 0, 'events': 0, 'changes': 0,
+                               'last_folded': 0, 'last_changes': 0, 'last_latency': 0}
+
         # Threads
         self.discover_thread = hub.spawn(self._discover_thread)
         
@@ -37,83 +62,280 @@ class TopologyData(app_manager.RyuApp):
         self.datapaths: dict[Datapath.id, Datapath] = {}  # Store switch in topology using OpenFlow
                 
         # Link and switch
-        self.switches = []
         self.access_table = {}       # {(sw,port) :(ip, mac)}
         self.switch_port_table = {}  # dpip->port_num
         self.access_ports = {}       # dpid->port_num
         self.interior_ports = {}     # {dpid: {port_num,...},...} - port_num is set of ports connected to other switches
         self.link_to_port = {}       # {(src.dpid, dst.dpid): (src.port_no, dst.port_no)}
+        self.port_links = {}         # {(dpid, port_no): {(src.dpid, dst.dpid),...}} - links using the port
+        self.switches = self.switch_port_table.keys()
+
+        # Bumped on every applied topology change
+        self.topology_version = 0
         
-        # Network Graph:
-        self.graph = nx.DiGraph()
+        # Network Graph: adjacency only, metrics are kept in link_metrics
+        self._graph = nx.DiGraph()
+        self.graph_version = None # (topology_version, link_metrics.version) the graph attributes are from
+
+        # Link metrics, one row per link of link_to_port
+        self.link_metrics = LinkMetricTable()
+        self.published_version = None # (topology_version, link_metrics.version) of the link_quality snapshot
+        self.graph_snapshot_version = None # (topology_version, link_metrics.version) of the topology_graph snapshot
+        self.link_snapshot_thread = hub.spawn(self._link_snapshot_thread)
+        self.topology_data_stale = True # hosts, switches or links changed since the topology_data snapshot
+
+    def start(self):
+        self._publish_topology_snapshot()
+        self.publish_link_snapshot()
+        return super(TopologyData, self).start()
+
+    @property
+    def graph(self):
+        """
+            Topology graph with the link metrics as edge attributes,
+            rebuilt from link_metrics on access when they changed.
+        """
+        version = (self.topology_version, self.link_metrics.version)
+        if self.graph_version != version:
+            self.link_metrics.materialize(self._graph)
+            self.graph_version = version
+        return self._graph
         
     def _discover_thread(self):
-        while True:
-            hub.sleep(DISCOVER_INTERVAL)
-    
-    def _get_graph(self, link_list):
         """
-            Get Adjacency matrix from link_to_port
+            Flush pending topology events once the burst settles.
         """
-        for src in self.switches:
-            for dst in self.switches:
-                if src == dst:
-                    self.graph.add_edge(src, dst, weight=0)
-                elif (src, dst) in link_list:
-                    self.graph.add_edge(src, dst, weight=1)
-        return self.graph
-    
-    def _create_port_map(self, switch_list):
+        while True:
+            if not self.pending_events:
+                self.pending_event.wait(timeout=DISCOVER_INTERVAL)
+                self.pending_event.clear()
+                continue
+
+            now = time.time()
+            delay = min(TOPOLOGY_DEBOUNCE_WINDOW - (now - self.last_pending),
+                        TOPOLOGY_MAX_LATENCY - (now - self.first_pending))
+            if delay > 0:
+                hub.sleep(delay)
+                continue
+            self._flush_topology_events()
+
+    def _link_snapshot_thread(self):
         """
-            Create interior_port table and access_port table.
+            Publish the link metrics written by the monitoring apps once per cycle.
         """
-        for sw in switch_list:
-            dpid = sw.dp.id
-            self.switch_port_table.setdefault(dpid, set())
-            self.interior_ports.setdefault(dpid, set())
-            self.access_ports.setdefault(dpid, set())
+        while True:
+            hub.sleep(GRAPH_UPDATE_INTERVAL)
+            self.publish_link_snapshot()
 
-            for p in sw.ports:
-                self.switch_port_table[dpid].add(p.port_no)
+    def _event_key(self, ev):
+        """
+            Events with the same key cancel out: only the latest one is applied.
+        """
+        if isinstance(ev, (event.EventSwitchEnter, event.EventSwitchLeave)):
+            return ('switch', ev.switch.dp.id)
+        if isinstance(ev, (event.EventLinkAdd, event.EventLinkDelete)):
+            src, dst = ev.link.src, ev.link.dst
+            return ('link', src.dpid, src.port_no, dst.dpid, dst.port_no)
+        return ('port', ev.port.dpid, ev.port.port_no)
 
-    def _create_access_ports(self):
+    def _flush_topology_events(self):
         """
-            Get ports without link into access_ports
+            Apply the net change set of all pending events in one pass.
         """
-        for sw in self.switch_port_table:
-            all_port_table = self.switch_port_table[sw]
-            interior_port = self.interior_ports[sw]
-            self.access_ports[sw] = all_port_table - interior_port
+        pending = sorted(self.pending_events.values(),
+                         key=lambda ev: self._EVENT_PHASE[type(ev)])
+        folded = self.pending_count
+        latency = time.time() - self.first_pending
+        self.pending_events = {}
+        self.pending_count = 0
 
+        self.topology_data_stale = True
+        changes = 0
+        for ev in pending:
+            if self._apply_topology_event(ev):
+                changes += 1
+        if changes:
+            self.topology_version += 1
+            self._publish_topology_snapshot()
+
+        stats = self.coalesce_stats
+        stats['flushes'] += 1
+        stats['events'] += folded
+        stats['changes'] += changes
+        stats['last_folded'] = folded
+        stats['last_changes'] = changes
+        stats['last_latency'] = latency
+        self.logger.debug('topology flush: %d events folded into %d changes in %.3fs (version %d)',
+                          folded, changes, latency, self.topology_version)
     
-    def _create_interior_links(self, link_list):
+    def _apply_topology_event(self, ev):
+        """
+            Apply one topology event as a delta to the port tables and graph.
+            Return True if the topology changed.
+        """
+        if isinstance(ev, event.EventSwitchEnter):
+            return self._add_switch(ev.switch)
+        if isinstance(ev, event.EventSwitchLeave):
+            return self._del_switch(ev.switch.dp.id)
+        if isinstance(ev, (event.EventPortAdd, event.EventPortModify)):
+            return self._add_port(ev.port)
+        if isinstance(ev, event.EventPortDelete):
+            return self._del_port(ev.port.dpid, ev.port.port_no)
+        if isinstance(ev, event.EventLinkAdd):
+            return self._add_link(ev.link)
+        if isinstance(ev, event.EventLinkDelete):
+            return self._del_link(ev.link)
+        return False
+
+    def _add_switch(self, switch):
+        """
+            Register a switch, its ports and the links already known to touch it.
+        """
+        dpid = switch.dp.id
+        ports = set(p.port_no for p in switch.ports)
+        if self.switch_port_table.get(dpid) == ports:
+            return False
+
+        self.switch_port_table[dpid] = ports
+        # Interior ports from the links holding them, including links that
+        # arrived before the switch, and none left from a previous port set
+        interior_port = set(port_no for (link_dpid, port_no) in self.port_links if link_dpid == dpid)
+        self.interior_ports[dpid] = interior_port
+        self.access_ports[dpid] = ports - interior_port
+
+        # Adjacency: self loop plus every known link between live switches
+        self._graph.add_edge(dpid, dpid, weight=0, delay=0, packet_loss=0)
+        for src, dst in self.link_to_port:
+            if dpid in (src, dst) and src in self.switch_port_table \
+               and dst in self.switch_port_table:
+                self._graph.add_edge(src, dst, weight=1)
+        return True
+
+    def _del_switch(self, dpid):
+        if dpid not in self.switch_port_table:
+            return False
+
+        for link in [link for link in self.link_to_port if dpid in link]:
+            self._del_link_key(link)
+
+        for port_no in self.switch_port_table.pop(dpid):
+            self.port_links.pop((dpid, port_no), None)
+        self.interior_ports.pop(dpid, None)
+        self.access_ports.pop(dpid, None)
+
+        if self._graph.has_node(dpid):
+            self._graph.remove_node(dpid)
+        return True
+
+    def _add_port(self, port):
+        dpid = port.dpid
+        if port.is_reserved() or dpid not in self.switch_port_table:
+            return False
+        if port.port_no in self.switch_port_table[dpid]:
+            return False
+
+        self.switch_port_table[dpid].add(port.port_no)
+        if port.port_no not in self.interior_ports[dpid]:
+            self.access_ports[dpid].add(port.port_no)
+        return True
+
+    def _del_port(self, dpid, port_no):
+        if port_no not in self.switch_port_table.get(dpid, ()):
+            return False
+
+        # Links riding on a deleted port are gone as well
+        for link in list(self.port_links.get((dpid, port_no), ())):
+            self._del_link_key(link)
+
+        self.switch_port_table[dpid].discard(port_no)
+        self.interior_ports[dpid].discard(port_no)
+        self.access_ports[dpid].discard(port_no)
+        return True
+
+    def _add_link(self, link):
         """
-            Get links source port to dst port from link_list,
             link_to_port:(src_dpid,dst_dpid)->(src_port,dst_port)
         """
-        for link in link_list:
-            src = link.src
-            dst = link.dst
-            self.link_to_port[(src.dpid, dst.dpid)] = (src.port_no, dst.port_no)
+        src = link.src
+        dst = link.dst
+        key = (src.dpid, dst.dpid)
+        ports = (src.port_no, dst.port_no)
+        if self.link_to_port.get(key) == ports:
+            return False
+        if key in self.link_to_port:
+            # Link between the same switches moved to other ports
+            self._del_link_key(key)
+
+        self.link_to_port[key] = ports
+        self.link_metrics.add(key)
+        self._hold_port(src.dpid, src.port_no, key)
+        self._hold_port(dst.dpid, dst.port_no, key)
+
+        if src.dpid in self.switch_port_table and dst.dpid in self.switch_port_table:
+            self._graph.add_edge(src.dpid, dst.dpid, weight=1)
+        return True
+
+    def _del_link(self, link):
+        key = (link.src.dpid, link.dst.dpid)
+        if self.link_to_port.get(key) != (link.src.port_no, link.dst.port_no):
+            return False
+        self._del_link_key(key)
+        return True
+
+    def _del_link_key(self, key):
+        src_port, dst_port = self.link_to_port.pop(key)
+        self.link_metrics.remove(key)
+        src_dpid, dst_dpid = key
+        self._release_port(src_dpid, src_port, key)
+        self._release_port(dst_dpid, dst_port, key)
+        if self._graph.has_edge(src_dpid, dst_dpid):
+            self._graph.remove_edge(src_dpid, dst_dpid)
+
+    def _hold_port(self, dpid, port_no, key):
+        """
+            Mark port as interior while at least one link uses it.
+        """
+        self.port_links.setdefault((dpid, port_no), set()).add(key)
+        if dpid in self.switch_port_table:
+            self.interior_ports[dpid].add(port_no)
+            self.access_ports[dpid].discard(port_no)
+
+    def _release_port(self, dpid, port_no, key):
+        links = self.port_links.get((dpid, port_no))
+        if links is None:
+            return
+        links.discard(key)
+        if links:
+            return
+
+        del self.port_links[(dpid, port_no)]
+        if dpid in self.switch_port_table:
+            self.interior_ports[dpid].discard(port_no)
+            if port_no in self.switch_port_table[dpid]:
+                self.access_ports[dpid].add(port_no)
 
-            # Find the access ports and interiorior ports
-            if link.src.dpid in self.switches:
-                self.interior_ports[link.src.dpid].add(link.src.port_no)
-            if link.dst.dpid in self.switches:
-                self.interior_ports[link.dst.dpid].add(link.dst.port_no)
-    
     @set_ev_cls([event.EventSwitchEnter,
                  event.EventSwitchLeave, event.EventPortAdd,
                  event.EventPortDelete, event.EventPortModify,
                  event.EventLinkAdd, event.EventLinkDelete])        
     def _get_topology(self, ev):
-        switch_list = get_switch(self.topology_api_app, None)
-        self._create_port_map(switch_list)
-        self.switches = self.switch_port_table.keys()
-        links = get_link(self.topology_api_app, None)
-        self._create_interior_links(links)
-        self._create_access_ports()
-        self._get_graph(self.link_to_port.keys())
+        """
+            Queue the event; the net change set is applied by _discover_thread.
+        """
+        now = time.time()
+        if not self.pending_events:
+            self.first_pending = now
+        self.last_pending = now
+
+        key = self._event_key(ev)
+        self.pending_events.pop(key, None)
+        self.pending_events[key] = ev
+        self.pending_count += 1
+        self.pending_event.set()
+
+    @set_ev_cls([event.EventHostAdd, event.EventHostDelete, event.EventHostMove])
+    def _host_change_handler(self, ev):
+        self.topology_data_stale = True
 
     @set_ev_cls(ofp_event.EventOFPStateChange,
                 [MAIN_DISPATCHER, DEAD_DISPATCHER])
@@ -128,6 +350,50 @@ class TopologyData(app_manager.RyuApp):
                 self.logger.debug('unregister datapath: %016x', datapath.id)
                 del self.datapaths[datapath.id]
 
+    # Snapshots:
+    def _publish_topology_snapshot(self):
+        snapshots.publish('link_to_port', self.get_link_ports())
+
+    def topology_data_snapshot(self):
+        """
+            Snapshot of hosts, switches and links: {'host', 'switch', 'link'},
+            republished on access when they changed. It queries the Switches
+            app, so it is built on demand by the REST API rather than by an
+            app thread.
+        """
+        snapshot = snapshots.get('topology_data')
+        if snapshot is None or self.topology_data_stale:
+            self.topology_data_stale = False
+            hosts, switches, links = self.get_topology_data()
+            snapshot = snapshots.publish('topology_data', {'host': hosts, 'switch': switches, 'link': links})
+        return snapshot
+
+    def publish_link_snapshot(self):
+        """
+            Publish the link_quality snapshot, if the topology or the link
+            metrics changed since it was published. Called every
+            GRAPH_UPDATE_INTERVAL by _link_snapshot_thread, whichever apps
+            wrote link metrics in between.
+        """
+        version = (self.topology_version, self.link_metrics.version)
+        if version == self.published_version:
+            return
+        self.published_version = version
+        snapshots.publish('link_quality', self.get_link_quality())
+
+    def topology_graph_snapshot(self):
+        """
+            Snapshot of the topology graph with its link metrics, republished on
+            access when they changed. Dumping the whole graph is costly, so it
+            is only built when the REST API asks for it.
+        """
+        snapshot = snapshots.get('topology_graph')
+        version = (self.topology_version, self.link_metrics.version)
+        if snapshot is None or self.graph_snapshot_version != version:
+            self.graph_snapshot_version = version
+            snapshot = snapshots.publish('topology_graph', self.get_topology_graph())
+        return snapshot
+
     '''
         accessor api:
     '''
@@ -149,6 +415,26 @@ class TopologyData(app_manager.RyuApp):
             self.logger.info("dpid:%s is not in interior_ports" % dpid)
             return None
 
+    def get_link_ports(self):
+        """
+            link_to_port for the REST API: {src_dpid: {dst_dpid: [src_port, dst_port]}, ...}
+        """
+        link_ports = {}
+        for (src_dpid, dst_dpid), ports in self.link_to_port.items():
+            link_ports.setdefault(src_dpid, {})[dst_dpid] = list(ports)
+        return link_ports
+
+    def get_coalesce_stats(self):
+        """
+            Topology event coalescing counters for the REST API
+        """
+        stats = dict(self.coalesce_stats)
+        stats['topology_version'] = self.topology_version
+        stats['pending'] = len(self.pending_events)
+        if stats['flushes']:
+            stats['avg_folded'] = stats['events'] / stats['flushes']
+        return stats
+
     def get_topology_data(self):
         """_summary_
             Get topology data for the REST API
@@ -230,23 +516,24 @@ class TopologyData(app_manager.RyuApp):
         Returns:
             A dict of link graph data structure
         """
+        links, metrics = self.link_metrics.records(('delay', 'delay_ewma', 'delay_p95', 'delay_jitter',
+                                                    'packet_loss', 'link_usage', 'free_bandwidth'))
         link_quality = []
-        for src, dst, value in self.graph.edges(data=True):
-            if src != dst:
-                
-                # I wish i understood Lambda function
-                packet_loss = value.get('packet_loss', None)
-                delay = value.get('delay', None)
-                link_usage = value.get('link_usage', None)
-                free_bandwith = value.get('free_bandwith', None)
-                link_quality.append({
-                    'src.dpid': src,
-                    'dst.dpid': dst,
-                    'delay': delay,
-                    'packet_loss': packet_loss,
-                    'link_usage': link_usage,
-                    'free_bandwidth': free_bandwith
-                })
+        for i, (src, dst) in enumerate(links):
+            if not self._graph.has_edge(src, dst):
+                # a switch of the link is gone
+                continue
+            link_quality.append({
+                'src.dpid': src,
+                'dst.dpid': dst,
+                'delay': metrics['delay'][i],
+                'delay_ewma': metrics['delay_ewma'][i],
+                'delay_p95': metrics['delay_p95'][i],
+                'delay_jitter': metrics['delay_jitter'][i],
+                'packet_loss': metrics['packet_loss'][i],
+                'link_usage': metrics['link_usage'][i],
+                'free_bandwidth': metrics['free_bandwidth'][i]
+            })
         return link_quality
     
     def get_topology_graph(self):
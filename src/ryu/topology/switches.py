@@ -21,7 +21,9 @@ from ryu import cfg
 
 from ryu.topology import event
 from ryu.base import app_manager
+from ryu.controller import handler
 from ryu.controller import ofp_event
+from ryu.controller.event import EventBase
 from ryu.controller.handler import set_ev_cls
 from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.exception import RyuException
@@ -52,7 +54,13 @@ CONF.register_cli_opts([
                 help='link discovery: explicitly install flow entry '
                      'to send lldp packet to controller'),
     cfg.BoolOpt('explicit-drop', default=True,
-                help='link discovery: explicitly drop lldp packet in')
+                help='link discovery: explicitly drop lldp packet in'),
+    cfg.BoolOpt('lldp-probe', default=False,
+                help='link discovery: embed send timestamp and sequence '
+                     'number in lldp packet to measure link delay'),
+    cfg.FloatOpt('lldp-probe-period', default=.9,
+                 help='link discovery: lldp send period per port '
+                      'in probe mode (seconds)')
 ])
 
 
@@ -250,10 +258,12 @@ class PortData(object):
         self.timestamp = None
         self.sent = 0
         self.delay = 0
+        self.seq = 0
 
     def lldp_sent(self):
         self.timestamp = time.time()
         self.sent += 1
+        self.seq = (self.seq + 1) & 0xffffffff
 
     def lldp_received(self):
         self.sent = 0
@@ -284,6 +294,7 @@ class PortDataState(dict):
         self._root = root = []  # sentinel node
         root[:] = [root, root, None]  # [_PREV, _NEXT, _KEY] doubly linked list
         self._map = {}
+        self._index = {}  # (dpid, port_no) -> Port class used as key
 
     def _remove_key(self, key):
         link_prev, link_next, key = self._map.pop(key)
@@ -314,6 +325,7 @@ class PortDataState(dict):
         if port not in self:
             self._prepend_key(port)
             self[port] = PortData(port.is_down(), lldp_data)
+            self._index[(port.dpid, port.port_no)] = port
         else:
             self[port].is_down = port.is_down()
 
@@ -344,9 +356,20 @@ class PortDataState(dict):
     def get_port(self, port):
         return self[port]
 
+    def get_port_by_no(self, dpid, port_no):
+        # O(1) lookup of the Port key without building a Port object
+        return self._index.get((dpid, port_no), None)
+
+    def get_port_data_by_no(self, dpid, port_no):
+        port = self._index.get((dpid, port_no), None)
+        if port is None:
+            return None
+        return self[port]
+
     def del_port(self, port):
         del self[port]
         self._remove_key(port)
+        del self._index[(port.dpid, port.port_no)]
 
     def __iter__(self):
         root = self._root
@@ -361,6 +384,7 @@ class PortDataState(dict):
         root = self._root
         root[:] = [root, root, None]
         self._map.clear()
+        self._index.clear()
         dict.clear(self)
 
     def items(self):
@@ -427,11 +451,19 @@ class LLDPPacket(object):
     PORT_ID_STR = '!I'      # uint32_t
     PORT_ID_SIZE = 4
 
+    # Organizationally specific TLV carrying the probe send time.
+    # Locally administered OUI, only understood by this controller.
+    PROBE_OUI = b'RYU'
+    PROBE_SUBTYPE = 1
+    PROBE_HEADER = PROBE_OUI + struct.pack('!B', PROBE_SUBTYPE)
+    PROBE_STR = '!QI'       # uint64_t send time (ns), uint32_t seq
+    PROBE_SIZE = 12
+
     class LLDPUnknownFormat(RyuException):
         message = '%(msg)s'
 
     @staticmethod
-    def lldp_packet(dpid, port_no, dl_addr, ttl):
+    def lldp_packet(dpid, port_no, dl_addr, ttl, probe=None):
         pkt = packet.Packet()
 
         dst = lldp.LLDP_MAC_NEAREST_BRIDGE
@@ -453,15 +485,36 @@ class LLDPPacket(object):
         tlv_ttl = lldp.TTL(ttl=ttl)
         tlv_end = lldp.End()
 
-        tlvs = (tlv_chassis_id, tlv_port_id, tlv_ttl, tlv_end)
+        tlvs = (tlv_chassis_id, tlv_port_id, tlv_ttl)
+        if probe is not None:
+            # probe: (send timestamp in ns, sequence number)
+            tlvs += (lldp.OrganizationallySpecific(
+                oui=LLDPPacket.PROBE_OUI, subtype=LLDPPacket.PROBE_SUBTYPE,
+                info=struct.pack(LLDPPacket.PROBE_STR, *probe)), )
+        tlvs += (tlv_end, )
         lldp_pkt = lldp.lldp(tlvs)
         pkt.add_protocol(lldp_pkt)
 
         pkt.serialize()
         return pkt.data
 
+    @staticmethod
+    def lldp_probe_stamp(data, timestamp, seq):
+        # fill in the probe TLV of a packet built with probe=(0, 0)
+        buf = bytearray(data)
+        offset = buf.rindex(LLDPPacket.PROBE_HEADER) + \
+            len(LLDPPacket.PROBE_HEADER)
+        struct.pack_into(LLDPPacket.PROBE_STR, buf, offset, timestamp, seq)
+        return bytes(buf)
+
     @staticmethod
     def lldp_parse(data):
+        src_dpid, src_port_no, _probe = LLDPPacket.lldp_parse_probe(data)
+        return src_dpid, src_port_no
+
+    @staticmethod
+    def lldp_parse_probe(data):
+        # returns probe as (send timestamp in ns, seq) or None
         pkt = packet.Packet(data)
         i = iter(pkt)
         eth_pkt = six.next(i)
@@ -491,7 +544,36 @@ class LLDPPacket(object):
                 msg='unknown port id %d' % port_id)
         (src_port_no, ) = struct.unpack(LLDPPacket.PORT_ID_STR, port_id)
 
-        return src_dpid, src_port_no
+        probe = None
+        for tlv in lldp_pkt.tlvs[3:]:
+            if tlv.tlv_type == lldp.LLDP_TLV_ORGANIZATIONALLY_SPECIFIC and \
+               tlv.oui == LLDPPacket.PROBE_OUI and \
+               tlv.subtype == LLDPPacket.PROBE_SUBTYPE and \
+               len(tlv.info) == LLDPPacket.PROBE_SIZE:
+                probe = struct.unpack(LLDPPacket.PROBE_STR, tlv.info)
+                break
+
+        return src_dpid, src_port_no, probe
+
+
+class EventLLDPPacketIn(EventBase):
+    # This is event class passed to link delay consumers.
+    # The LLDP packet-in is parsed once by Switches.
+    # send_timestamp and seq are only set for lldp-probe packets.
+    def __init__(self, src_dpid, src_port_no, dst_dpid, dst_port_no,
+                 recv_timestamp, send_timestamp=None, seq=None):
+        super(EventLLDPPacketIn, self).__init__()
+        self.src_dpid = src_dpid
+        self.src_port_no = src_port_no
+        self.dst_dpid = dst_dpid
+        self.dst_port_no = dst_port_no
+        self.recv_timestamp = recv_timestamp
+        self.send_timestamp = send_timestamp
+        self.seq = seq
+
+    def __str__(self):
+        return 'EventLLDPPacketIn<%s:%s -> %s:%s>' % \
+            (self.src_dpid, self.src_port_no, self.dst_dpid, self.dst_port_no)
 
 
 class Switches(app_manager.RyuApp):
@@ -502,10 +584,13 @@ class Switches(app_manager.RyuApp):
                event.EventPortAdd, event.EventPortDelete,
                event.EventPortModify,
                event.EventLinkAdd, event.EventLinkDelete,
-               event.EventHostAdd]
+               event.EventHostAdd, EventLLDPPacketIn]
 
     DEFAULT_TTL = 120  # unused. ignored.
-    LLDP_PACKET_LEN = len(LLDPPacket.lldp_packet(0, 0, DONTCARE_STR, 0))
+    LLDP_PACKET_LEN = len(LLDPPacket.lldp_packet(0, 0, DONTCARE_STR, 0,
+                                                 probe=(0, 0)))
+    LLDP_MAC_NEAREST_BRIDGE_BIN = addrconv.mac.text_to_bin(
+        lldp.LLDP_MAC_NEAREST_BRIDGE)
 
     LLDP_SEND_GUARD = .05
     LLDP_SEND_PERIOD_PER_PORT = .9
@@ -528,6 +613,11 @@ class Switches(app_manager.RyuApp):
         if self.link_discovery:
             self.install_flow = self.CONF.install_lldp_flow
             self.explicit_drop = self.CONF.explicit_drop
+            self.lldp_probe = self.CONF.lldp_probe
+            if self.lldp_probe:
+                # delay comes from the packet itself, so ports can be
+                # probed more often than the send time bookkeeping allows
+                self.LLDP_SEND_PERIOD_PER_PORT = self.CONF.lldp_probe_period
             self.lldp_event = hub.Event()
             self.link_event = hub.Event()
             self.threads.append(hub.spawn(self.lldp_loop))
@@ -570,8 +660,10 @@ class Switches(app_manager.RyuApp):
                     return p
 
     def _port_added(self, port):
+        # in probe mode the probe TLV is stamped on every send
+        probe = (0, 0) if self.lldp_probe else None
         lldp_data = LLDPPacket.lldp_packet(
-            port.dpid, port.port_no, port.hw_addr, self.DEFAULT_TTL)
+            port.dpid, port.port_no, port.hw_addr, self.DEFAULT_TTL, probe)
         self.ports.add_port(port, lldp_data)
         # LOG.debug('_port_added dpid=%s, port_no=%s, live=%s',
         #           port.dpid, port.port_no, port.is_live())
@@ -766,17 +858,37 @@ class Switches(app_manager.RyuApp):
             LOG.error('cannot drop_packet. unsupported version. %x',
                       dp.ofproto.OFP_VERSION)
 
-    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
-    def lldp_packet_in_handler(self, ev):
-        if not self.link_discovery:
-            return
+    @staticmethod
+    def _peek_ethertype(data):
+        # ethertype of the frame, read without decoding the packet
+        if len(data) < 14:
+            return None
+        (ethertype, ) = struct.unpack_from('!H', data, 12)
+        return ethertype
 
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def packet_in_handler(self, ev):
+        # add code for getting LLDP packet receiving timestamp
+        recv_timestamp = time.time()
         msg = ev.msg
+
+        # Classify once: LLDP goes to link discovery and delay measurement,
+        # everything else except CFM to host discovery.
+        ethertype = self._peek_ethertype(msg.data)
+        if ethertype == ETH_TYPE_LLDP:
+            # LLDP to another group address (e.g. loss probes) isn't ours
+            if self.link_discovery and \
+               msg.data[:6] == self.LLDP_MAC_NEAREST_BRIDGE_BIN:
+                self._lldp_packet_in(msg, recv_timestamp)
+        elif ethertype != ETH_TYPE_CFM:
+            self._host_discovery_packet_in(msg)
+
+    def _lldp_packet_in(self, msg, recv_timestamp):
         try:
-            src_dpid, src_port_no = LLDPPacket.lldp_parse(msg.data)
+            src_dpid, src_port_no, probe = \
+                LLDPPacket.lldp_parse_probe(msg.data)
         except LLDPPacket.LLDPUnknownFormat:
-            # This handler can receive all the packets which can be
-            # not-LLDP packet. Ignore it silently
+            # LLDP from another agent. Ignore it silently
             return
 
         dst_dpid = msg.datapath.id
@@ -787,6 +899,25 @@ class Switches(app_manager.RyuApp):
         else:
             LOG.error('cannot accept LLDP. unsupported version. %x',
                       msg.datapath.ofproto.OFP_VERSION)
+            return
+
+        # get the lldp delay, and save it into port_data.
+        # A probe carries its own send time, immune to reordering and to
+        # later sends overwriting port_data.timestamp.
+        send_timestamp = seq = None
+        if probe is not None:
+            send_timestamp = probe[0] / 10 ** 9
+            seq = probe[1]
+        port_data = self.ports.get_port_data_by_no(src_dpid, src_port_no)
+        if port_data is not None:
+            if send_timestamp is not None:
+                port_data.delay = recv_timestamp - send_timestamp
+            elif port_data.timestamp:
+                port_data.delay = recv_timestamp - port_data.timestamp
+
+        self.send_event_to_observers(EventLLDPPacketIn(
+            src_dpid, src_port_no, dst_dpid, dst_port_no, recv_timestamp,
+            send_timestamp, seq))
 
         src = self._get_port(src_dpid, src_port_no)
         if not src or src.dpid == dst_dpid:
@@ -835,15 +966,9 @@ class Switches(app_manager.RyuApp):
         if self.explicit_drop:
             self._drop_packet(msg)
 
-    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
-    def host_discovery_packet_in_handler(self, ev):
-        msg = ev.msg
+    def _host_discovery_packet_in(self, msg):
         eth, pkt_type, pkt_data = ethernet.ethernet.parser(msg.data)
 
-        # ignore lldp and cfm packets
-        if eth.ethertype in (ETH_TYPE_LLDP, ETH_TYPE_CFM):
-            return
-
         datapath = msg.datapath
         dpid = datapath.id
         port_no = -1
@@ -906,17 +1031,22 @@ class Switches(app_manager.RyuApp):
             # datapath was already deleted
             return
 
+        lldp_data = port_data.lldp_data
+        if self.lldp_probe:
+            lldp_data = LLDPPacket.lldp_probe_stamp(
+                lldp_data, time.time_ns(), port_data.seq)
+
         # LOG.debug('lldp sent dpid=%s, port_no=%d', dp.id, port.port_no)
         # TODO:XXX
         if dp.ofproto.OFP_VERSION == ofproto_v1_0.OFP_VERSION:
             actions = [dp.ofproto_parser.OFPActionOutput(port.port_no)]
-            dp.send_packet_out(actions=actions, data=port_data.lldp_data)
+            dp.send_packet_out(actions=actions, data=lldp_data)
         elif dp.ofproto.OFP_VERSION >= ofproto_v1_2.OFP_VERSION:
             actions = [dp.ofproto_parser.OFPActionOutput(port.port_no)]
             out = dp.ofproto_parser.OFPPacketOut(
                 datapath=dp, in_port=dp.ofproto.OFPP_CONTROLLER,
                 buffer_id=dp.ofproto.OFP_NO_BUFFER, actions=actions,
-                data=port_data.lldp_data)
+                data=lldp_data)
             dp.send_msg(out)
         else:
             LOG.error('cannot send lldp packet. unsupported version. %x',
@@ -943,11 +1073,16 @@ class Switches(app_manager.RyuApp):
                 timeout = expire - now
                 break
 
+            guard = self.LLDP_SEND_GUARD
+            if self.lldp_probe and ports:
+                # keep a round within the probe period
+                guard = min(guard, self.LLDP_SEND_PERIOD_PER_PORT / len(ports))
+
             for port in ports_now:
                 self.send_lldp_packet(port)
             for port in ports:
                 self.send_lldp_packet(port)
-                hub.sleep(self.LLDP_SEND_GUARD)      # don't burst
+                hub.sleep(guard)      # don't burst
 
             if timeout is not None and ports:
                 timeout = 0     # We have already slept
@@ -1028,35 +1163,6 @@ class Switches(app_manager.RyuApp):
 
         rep = event.EventHostReply(req.src, dpid, hosts)
         self.reply_to_request(req, rep)
-        
 
-    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
-    def packet_in_handler(self, ev):
-    	# add code for getting LLDP packet receiving timestamp
-        recv_timestamp = time.time()
-        if not self.link_discovery:
-            return
-    
-        msg = ev.msg
-        try:
-            src_dpid, src_port_no = LLDPPacket.lldp_parse(msg.data)
-        except LLDPPacket.LLDPUnknownFormat as e:
-            # This handler can receive all the packtes which can be
-            # not-LLDP packet. Ignore it silently
-            return
-    
-        dst_dpid = msg.datapath.id
-        if msg.datapath.ofproto.OFP_VERSION == ofproto_v1_0.OFP_VERSION:
-            dst_port_no = msg.in_port
-        elif msg.datapath.ofproto.OFP_VERSION >= ofproto_v1_2.OFP_VERSION:
-            dst_port_no = msg.match['in_port']
-        else:
-            LOG.error('cannot accept LLDP. unsupported version. %x',
-                      msg.datapath.ofproto.OFP_VERSION)
-    
-        # get the lldp delay, and save it into port_data.
-        for port in self.ports.keys():
-            if src_dpid == port.dpid and src_port_no == port.port_no:
-                send_timestamp = self.ports[port].timestamp
-                if send_timestamp:
-                    self.ports[port].delay = recv_timestamp - send_timestamp
+
+handler.register_service('ryu.topology.switches')
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+    Micro-benchmark of the LLDP delay port lookup in the patched
+    src/ryu/topology/switches.py: PortDataState.get_port_data_by_no against
+    the linear scan of every port key it replaced, at several port counts:
+    the scan grows with the ports, the index stays flat.
+
+    python tests/bench_port_lookup.py [total ports,...] [ports per switch]
+"""
+import importlib.util
+import os
+import sys
+import timeit
+
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+SWITCHES_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'src', 'ryu', 'topology', 'switches.py')
+
+
+def load_switches():
+    spec = importlib.util.spec_from_file_location('patched_switches', SWITCHES_PY)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module # looked up by ryu's register_service
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_ports(switches, total, n_ports):
+    """
+        total ports, n_ports per switch (the last one may have fewer)
+    """
+    ports = switches.PortDataState()
+    for i in range(total):
+        dpid, port_no = i // n_ports + 1, i % n_ports + 1
+        ofpport = ofproto_v1_3_parser.OFPPort(port_no, '00:00:00:00:00:00', b'eth',
+                                               0, 0, 0, 0, 0, 0, 0, 0)
+        ports.add_port(switches.Port(dpid, ofproto_v1_3, ofpport), None)
+    return ports
+
+
+def linear_scan(ports, dpid, port_no):
+    # lookup done on every LLDP packet-in before the (dpid, port_no) index
+    for port in ports.keys():
+        if dpid == port.dpid and port_no == port.port_no:
+            return ports[port]
+    return None
+
+
+def time_lookups(switches, total, n_ports):
+    """
+        (ports, seconds per linear scan, seconds per index lookup)
+    """
+    ports = build_ports(switches, total, n_ports)
+    # worst case of the scan: the port it reaches last
+    last = list(ports.keys())[-1]
+    dpid, port_no = last.dpid, last.port_no
+    assert linear_scan(ports, dpid, port_no) is ports.get_port_data_by_no(dpid, port_no)
+
+    number = max(1, 100000 // len(ports))
+    scan = min(timeit.repeat(lambda: linear_scan(ports, dpid, port_no), number=number, repeat=5)) / number
+    number = 10000
+    index = min(timeit.repeat(lambda: ports.get_port_data_by_no(dpid, port_no), number=number, repeat=5)) / number
+    return len(ports), scan, index
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1].split(',')] if len(sys.argv) > 1 else [80, 5000, 20000]
+    n_ports = int(sys.argv[2]) if len(sys.argv) > 2 else 48
+    switches = load_switches()
+    print('%8s %16s %16s %10s' % ('ports', 'linear scan (us)', 'index (us)', 'speedup'))
+    for size in sizes:
+        total, scan, index = time_lookups(switches, size, n_ports)
+        print('%8d %16.3f %16.3f %9.0fx' % (total, scan * 1e6, index * 1e6, scan / index))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+# The ryu apps import each other as top level modules, as ryu-manager runs them
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'ryu-app'))
@@ -0,0 +1,82 @@
+import numpy as np
+
+from delay_stats import DelayStats
+
+ROWS = np.array([0, 1])
+
+
+def feed(stats, samples):
+    """
+        samples: [sample][row] delays, one add() per sample.
+    """
+    for delay in samples:
+        stats.add(ROWS, np.asarray(delay, dtype=np.float64))
+
+
+def test_quantiles_match_percentile():
+    rng = np.random.default_rng(1)
+    window = 2000
+    samples = np.stack((rng.uniform(0, 1, window), rng.exponential(0.01, window)), axis=1)
+    stats = DelayStats(window=window, rows=2)
+    feed(stats, samples)
+    summary = stats.summary(ROWS)
+    # the older sketch set has seen every sample
+    for row, scale in ((0, 1), (1, 0.01)):
+        for name, q in (('p50', 50), ('p95', 95), ('p99', 99)):
+            expected = np.percentile(samples[:, row], q)
+            assert np.isclose(summary[name][row], expected, rtol=0.05, atol=0.01 * scale), (row, name)
+        assert summary['min'][row] == samples[:, row].min()
+    assert summary['samples'].tolist() == [window, window]
+
+
+def test_few_samples_nearest_rank():
+    stats = DelayStats(window=100, rows=2)
+    feed(stats, [(3, 1), (1, 1), (2, 1)])
+    summary = stats.summary(ROWS)
+    assert summary['p50'].tolist() == [2, 1]
+    assert summary['p99'].tolist() == [3, 1]
+    assert summary['min'].tolist() == [1, 1]
+
+
+def test_ewma_and_rfc3550_jitter():
+    alpha = 0.25
+    delays = [0.010, 0.014, 0.011, 0.020, 0.012, 0.012]
+    stats = DelayStats(window=100, alpha=alpha, rows=2)
+    ewma = jitter = None
+    for i, delay in enumerate(delays):
+        stats.add(ROWS[:1], np.array([delay]))
+        if i == 0:
+            ewma, jitter = delay, 0
+        else:
+            ewma += alpha * (delay - ewma)
+            # RFC 3550 6.4.1: J += (|D(i-1, i)| - J) / 16
+            jitter += (abs(delay - delays[i - 1]) - jitter) / 16
+        summary = stats.summary(ROWS[:1])
+        assert np.isclose(summary['ewma'][0], ewma)
+        assert np.isclose(summary['jitter'][0], jitter)
+
+
+def test_window_restart_drops_old_samples():
+    window = 100
+    stats = DelayStats(window=window, rows=2)
+    feed(stats, np.full((window, 2), 10.0))
+    for i in range(window):
+        feed(stats, np.full((1, 2), 1.0))
+        summary = stats.summary(ROWS)
+        # an estimate always covers at least half a window
+        assert not np.isnan(summary['p50']).any()
+    summary = stats.summary(ROWS)
+    assert summary['p50'].tolist() == [1, 1]
+    assert summary['p99'].tolist() == [1, 1]
+    assert summary['min'].tolist() == [1, 1]
+
+
+def test_follow_resets_reused_rows():
+    stats = DelayStats(window=100, rows=2)
+    stats.follow(ROWS, [(1, 2), (2, 1)])
+    feed(stats, [(5, 5)] * 10)
+    stats.follow(ROWS, [(1, 2), (2, 3)])
+    summary = stats.summary(ROWS)
+    assert summary['p50'][0] == 5 and summary['samples'][0] == 10
+    assert np.isnan(summary['p50'][1]) and np.isnan(summary['ewma'][1])
+    assert summary['samples'][1] == 0
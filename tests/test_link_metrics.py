@@ -0,0 +1,89 @@
+import math
+
+import networkx as nx
+import numpy as np
+
+from link_metrics import LinkMetricTable
+
+METRICS = ('delay', 'packet_loss')
+
+
+def test_add_is_idempotent():
+    table = LinkMetricTable(METRICS)
+    row = table.add((1, 2))
+    version = table.version
+    assert table.add((1, 2)) == row
+    assert table.version == version
+    assert len(table) == 1 and (1, 2) in table
+
+
+def test_removed_row_is_reused_without_old_values():
+    table = LinkMetricTable(METRICS, rows=2)
+    row = table.add((1, 2))
+    table.set_link('delay', (1, 2), 0.5, now=10)
+    table.remove((1, 2))
+    assert (1, 2) not in table
+    assert table.add((3, 4)) == row
+    assert table.get('delay', (3, 4)) is None
+    assert math.isnan(table.updated['delay'][row])
+
+
+def test_lookup_after_churn():
+    table = LinkMetricTable(METRICS, rows=2)
+    for link in ((1, 2), (2, 1), (1, 3), (3, 1)):
+        table.add(link)
+    table.remove((2, 1))
+    table.remove((1, 3))
+    table.add((2, 3))
+    rows = table.lookup([(1, 2), (2, 1), (3, 1), (2, 3), (9, 9)])
+    assert rows.tolist() == [table.rows[(1, 2)], -1, table.rows[(3, 1)], table.rows[(2, 3)], -1]
+    assert len(set(table.rows.values())) == len(table) == 3
+
+
+def test_set_skips_unknown_rows():
+    table = LinkMetricTable(METRICS)
+    table.add((1, 2))
+    table.add((2, 1))
+    rows = table.lookup([(1, 2), (5, 5), (2, 1)])
+    table.set('delay', rows, [0.1, 0.2, 0.3], now=1)
+    assert table.get('delay', (1, 2)) == 0.1
+    assert table.get('delay', (2, 1)) == 0.3
+
+
+def test_live_cache_follows_changes():
+    table = LinkMetricTable(METRICS)
+    table.add((1, 2))
+    rows, links = table.live()
+    assert table.live()[1] is links
+    table.add((2, 1))
+    rows, links = table.live()
+    assert links == [table.row_links[row] for row in rows.tolist()]
+    assert sorted(links) == [(1, 2), (2, 1)]
+    table.remove((1, 2))
+    assert table.live()[1] == [(2, 1)]
+
+
+def test_records_unset_metric_is_none():
+    table = LinkMetricTable(METRICS)
+    table.add((1, 2))
+    table.add((2, 1))
+    table.set_link('delay', (2, 1), 0.25)
+    links, records = table.records()
+    delay = dict(zip(links, records['delay']))
+    assert delay == {(1, 2): None, (2, 1): 0.25}
+    assert records['packet_loss'] == [None, None]
+
+
+def test_materialize_edge_attributes():
+    table = LinkMetricTable(METRICS)
+    for link in ((1, 2), (2, 1), (2, 3)):
+        table.add(link)
+    table.set('packet_loss', table.lookup([(1, 2), (2, 1)]), np.array([0.1, 0.0]))
+    table.set_link('delay', (1, 2), 0.002)
+    graph = nx.DiGraph()
+    graph.add_edge(1, 2, weight=1)
+    graph.add_edge(2, 1)
+    table.materialize(graph)
+    assert graph[1][2] == {'weight': 1, 'delay': 0.002, 'packet_loss': 0.1}
+    assert graph[2][1] == {'delay': None, 'packet_loss': 0.0}
+    assert not graph.has_edge(2, 3)
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from metric_stream import MetricStream, StreamFilter, STREAM_KEYS
+from snapshot import SnapshotStore
+
+LINK_KEYS = STREAM_KEYS['link_quality']
+
+
+def link(src, dst, delay=0.001, packet_loss=0.0):
+    return {'src.dpid': src, 'dst.dpid': dst, 'delay': delay, 'packet_loss': packet_loss}
+
+
+def test_parse_query_values():
+    stream_filter = StreamFilter.parse({'resource': 'link_quality,port_stat', 'dpid': '1,0x10,',
+                                        'metric': 'delay'})
+    assert stream_filter.resources == {'link_quality', 'port_stat'}
+    assert stream_filter.dpids == {1, 16}
+    assert stream_filter.metrics == {'delay'}
+    assert StreamFilter.parse({'dpid': [2, '3']}).dpids == {2, 3}
+    assert StreamFilter.parse({}).unfiltered()
+    with pytest.raises(ValueError):
+        StreamFilter.parse({'dpid': 'x'})
+
+
+def test_filter_resource_and_dpid():
+    changed = [(None, link(1, 2)), (None, link(3, 4))]
+    removed = [{'src.dpid': 4, 'dst.dpid': 3}, {'src.dpid': 5, 'dst.dpid': 6}]
+    assert StreamFilter(resources={'port_stat'}).apply('link_quality', LINK_KEYS, changed, removed) == ([], [])
+    items, keys = StreamFilter(dpids={3}).apply('link_quality', LINK_KEYS, changed, removed)
+    assert items == [link(3, 4)]
+    assert keys == [{'src.dpid': 4, 'dst.dpid': 3}]
+
+
+def test_filter_metric_projects_changed_fields():
+    changed = [
+        (link(1, 2, delay=0.001), link(1, 2, delay=0.002)),
+        (link(2, 1, delay=0.001), link(2, 1, delay=0.001, packet_loss=0.5)),
+        (None, link(1, 3)),
+    ]
+    items, _ = StreamFilter(metrics={'delay'}).apply('link_quality', LINK_KEYS, changed, [])
+    assert items == [{'src.dpid': 1, 'dst.dpid': 2, 'delay': 0.002},
+                     {'src.dpid': 1, 'dst.dpid': 3, 'delay': 0.001}]
+
+
+def test_diff_changed_and_removed():
+    stream = MetricStream(SnapshotStore())
+    old = [link(1, 2), link(2, 1), link(1, 3)]
+    new = [link(1, 2), link(2, 1, delay=0.005), link(3, 1)]
+    changed, removed = stream._diff(LINK_KEYS, old, new)
+    assert changed == [(link(2, 1), link(2, 1, delay=0.005)), (None, link(3, 1))]
+    assert removed == [{'src.dpid': 1, 'dst.dpid': 3}]
+
+
+def test_publish_queues_deltas():
+    store = SnapshotStore()
+    stream = MetricStream(store)
+    store.publish('link_quality', [link(1, 2)])
+    client = stream.connect(StreamFilter())
+    filtered = stream.connect(StreamFilter(dpids={3}))
+    snapshot = store.publish('link_quality', [link(1, 2, delay=0.002), link(3, 1)])
+    message = json.loads(client.queue.get_nowait())
+    assert message['version'] == snapshot.version
+    assert message['changed'] == [link(1, 2, delay=0.002), link(3, 1)]
+    assert message['removed'] == []
+    assert json.loads(filtered.queue.get_nowait())['changed'] == [link(3, 1)]
+    # unchanged snapshot, or resource not streamed: nothing queued
+    store.publish('link_quality', [link(1, 2, delay=0.002), link(3, 1)])
+    store.publish('topology_graph', {})
+    assert client.queue.qsize() == 0
+
+
+def test_full_queue_drops_client():
+    store = SnapshotStore()
+    stream = MetricStream(store, queue_size=2)
+    slow = stream.connect(StreamFilter())
+    for i in range(3):
+        store.publish('link_quality', [link(1, 2, delay=i)])
+    assert slow.closed
+    assert slow not in stream.clients
+    assert stream.dropped == 1
+    assert slow.queue.qsize() == 2
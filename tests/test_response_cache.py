@@ -0,0 +1,50 @@
+import gzip
+
+from response_cache import CachedBody, ResponseCache, accepts_gzip, etag_matches
+from snapshot import SnapshotStore
+
+
+def test_etag_matches():
+    etag = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"x", W/"abc" ,"y"', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches('"abcd"', etag)
+    assert not etag_matches('', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_accepts_gzip():
+    assert accepts_gzip('gzip')
+    assert accepts_gzip('deflate, GZIP')
+    assert accepts_gzip('br;q=1.0, gzip;q=0.5')
+    assert accepts_gzip('*')
+    assert not accepts_gzip('gzip;q=0')
+    assert not accepts_gzip('gzip;q=x')
+    assert not accepts_gzip('identity')
+    assert not accepts_gzip(None)
+
+
+def test_gzip_etag_is_distinct():
+    cached = CachedBody(1, b'{"a": 1}')
+    assert cached.gzip_etag != cached.etag
+    assert cached.gzip_etag.endswith('-gzip"')
+    assert not etag_matches(cached.etag, cached.gzip_etag)
+    assert gzip.decompress(cached.gzip_body()) == cached.body
+    assert cached.gzip_body() is cached.gzip_body()
+    # content derived: the same body gives the same tags
+    assert CachedBody(2, b'{"a": 1}').etag == cached.etag
+
+
+def test_cache_rebuilds_on_new_version():
+    store = SnapshotStore()
+    cache = ResponseCache()
+    first = cache.get('link_quality', store.publish('link_quality', [1]))
+    snapshot = store.get('link_quality')
+    assert cache.get('link_quality', snapshot) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    second = cache.get('link_quality', store.publish('link_quality', [2]))
+    assert second is not first
+    assert second.body == b'[2]' and second.etag != first.etag
+    assert (cache.hits, cache.misses) == (1, 2)
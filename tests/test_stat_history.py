@@ -0,0 +1,96 @@
+import numpy as np
+
+from stat_history import StatHistory, UNSUPPORTED, counter_delta
+
+COLUMNS = ('packets', 'bytes')
+
+
+def test_append_keeps_latest_samples():
+    history = StatHistory(COLUMNS, capacity=3)
+    for i in range(5):
+        history.append('a', (i, 10 * i), stamp=i)
+    assert history.samples('a') == 3
+    assert history.last('a') == (4, 40)
+    assert history.last('a', 2) == (3, 30)
+    assert history.latest('a').tolist() == [[2, 20], [3, 30], [4, 40]]
+
+
+def test_append_unsupported_counter():
+    history = StatHistory(COLUMNS)
+    history.append('a', (1, UNSUPPORTED))
+    history.append_batch(['b'], np.array([(2, UNSUPPORTED)], dtype=np.uint64))
+    assert history.last('a') == (1, 2 ** 64 - 1)
+    assert history.last('b') == (2, 2 ** 64 - 1)
+
+
+def test_append_batch_matches_append():
+    keys = ['a', 'b', 'c']
+    one = StatHistory(COLUMNS, capacity=2)
+    batch = StatHistory(COLUMNS, capacity=2)
+    for i in range(3):
+        values = np.array([(i, k) for k in range(len(keys))], dtype=np.uint64)
+        for key, value in zip(keys, values):
+            one.append(key, value)
+        rows = batch.append_batch(keys, values)
+        assert batch.take(rows).tolist() == values.tolist()
+    for key in keys:
+        assert one.latest(key).tolist() == batch.latest(key).tolist()
+
+
+def test_append_batch_same_key_twice():
+    history = StatHistory(COLUMNS)
+    history.append_batch(['a', 'a'], np.array([(1, 1), (2, 2)], dtype=np.uint64))
+    assert history.samples('a') == 2
+    assert history.last('a') == (2, 2)
+    assert history.last('a', 2) == (1, 1)
+
+
+def test_grow_keeps_samples():
+    history = StatHistory(COLUMNS, rows=2)
+    for key in range(10):
+        history.append(key, (key, key))
+    assert len(history) == 10
+    assert all(history.last(key) == (key, key) for key in range(10))
+
+
+def test_remove_reuses_row():
+    history = StatHistory(COLUMNS, rows=2)
+    history.append('a', (1, 1))
+    row = history.rows['a']
+    history.remove('a')
+    assert 'a' not in history and history.samples('a') == 0
+    history.append('b', (2, 2))
+    assert history.rows['b'] == row
+    assert history.samples('b') == 1
+
+
+def test_stale_and_oldest():
+    history = StatHistory(COLUMNS)
+    for stamp, key in enumerate('abc'):
+        history.append(key, (0, 0), stamp=stamp)
+    assert sorted(history.stale(2)) == ['a', 'b']
+    assert [key for _, key in sorted(history.oldest(2))] == ['a', 'b']
+
+
+def test_signed_history():
+    history = StatHistory(COLUMNS, dtype=np.int64)
+    history.append('a', (-1, 5))
+    assert history.last('a') == (-1, 5)
+
+
+def test_counter_delta():
+    new = np.array([[10, UNSUPPORTED, 5]], dtype=np.uint64)
+    old = np.array([[4, UNSUPPORTED, 7]], dtype=np.uint64)
+    assert counter_delta(new, old).tolist() == [[6, 0, -2]]
+
+
+def test_counter_delta_wraparound():
+    new = np.array([3], dtype=np.uint64)
+    old = np.array([2 ** 64 - 3], dtype=np.uint64)
+    assert counter_delta(new, old).tolist() == [6]
+
+
+def test_counter_delta_unsupported_in_one_sample():
+    new = np.array([UNSUPPORTED, 8], dtype=np.uint64)
+    old = np.array([1, UNSUPPORTED], dtype=np.uint64)
+    assert counter_delta(new, old).tolist() == [0, 0]